@@ -0,0 +1,153 @@
+import os
+import json
+from pathlib import Path
+from typing import Optional, Tuple
+import numpy as np
+
+from embedding_store import EmbeddingMatrix, dequantize
+
+INDEX_VERSION = 1
+KMEANS_ITERATIONS = 10
+# Centroids are trained on a sample of this many faces per list
+TRAIN_SAMPLES_PER_LIST = 64
+# Once the faces outgrow the trained size this many times, lists get too long to stay fast
+RETRAIN_GROWTH = 4.0
+ASSIGN_CHUNK = 8192
+
+
+def list_count_for(n_faces: int) -> int:
+    return int(min(4096, max(16, 4 * np.sqrt(n_faces))))
+
+
+def _unit_rows(embeddings: EmbeddingMatrix, rows) -> np.ndarray:
+    vectors = dequantize(*embeddings.gather(rows))
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+class IVFIndex:
+    """Inverted file index over the stored embeddings for building the kNN graph.
+
+    Faces are split into lists around k-means centroids. To find a face's neighbors only
+    the lists of the centroids nearest to its own are searched, so the work per face
+    stays bounded instead of growing with the whole collection. The centroids and the
+    list of every face id are saved next to the database; on later runs new faces are
+    only assigned to their nearest centroid, and the centroids are trained again when the
+    collection has grown RETRAIN_GROWTH times past the size they were trained on.
+    """
+
+    def __init__(self, folder: str):
+        self.folder = Path(folder)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.centroids: Optional[np.ndarray] = None
+        self.face_ids = np.empty(0, dtype=np.int64)
+        self.list_ids = np.empty(0, dtype=np.int32)
+        self.trained_size = 0
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.folder / "index.json", 'r') as f:
+                meta = json.load(f)
+            if meta.get('version') != INDEX_VERSION:
+                return
+            self.centroids = np.load(self.folder / "centroids.npy")
+            self.face_ids = np.load(self.folder / "face_ids.npy")
+            self.list_ids = np.load(self.folder / "list_ids.npy")
+            self.trained_size = meta['trained_size']
+        except (OSError, ValueError, KeyError) as e:
+            if not isinstance(e, FileNotFoundError):
+                print(f"ANN index could not be loaded, it will be rebuilt: {e}")
+            self.centroids = None
+
+    def _save(self):
+        for name, array in (('centroids', self.centroids), ('face_ids', self.face_ids), ('list_ids', self.list_ids)):
+            temp_path = self.folder / f"{name}.tmp.npy"
+            np.save(temp_path, array)
+            os.replace(temp_path, self.folder / f"{name}.npy")
+
+        temp_path = self.folder / "index.json.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump({'version': INDEX_VERSION, 'trained_size': self.trained_size}, f)
+        os.replace(temp_path, self.folder / "index.json")
+
+    def needs_training(self, n_faces: int, dim: int) -> bool:
+        return (
+            self.centroids is None
+            or self.centroids.shape[1] != dim
+            or n_faces > self.trained_size * RETRAIN_GROWTH
+        )
+
+    def update(self, face_ids: np.ndarray, embeddings: EmbeddingMatrix) -> Tuple[np.ndarray, bool]:
+        """Returns the list of every row of embeddings, and whether centroids were trained.
+
+        Faces indexed before keep their list, new ones join their nearest centroid and
+        faces that are gone drop out of the saved index.
+        """
+        face_ids = np.asarray(face_ids, dtype=np.int64)
+        trained = self.needs_training(len(face_ids), embeddings.dim)
+
+        if trained:
+            self.centroids = self._train(embeddings)
+            self.trained_size = len(face_ids)
+            list_ids = self._assign(embeddings, np.arange(len(face_ids)))
+        else:
+            list_ids = np.full(len(face_ids), -1, dtype=np.int32)
+            if len(self.face_ids):
+                order = np.argsort(self.face_ids)
+                positions = np.searchsorted(self.face_ids, face_ids, sorter=order)
+                positions = order[np.minimum(positions, len(order) - 1)]
+                known = self.face_ids[positions] == face_ids
+                list_ids[known] = self.list_ids[positions[known]]
+
+            new_rows = np.nonzero(list_ids < 0)[0]
+            if len(new_rows):
+                list_ids[new_rows] = self._assign(embeddings, new_rows)
+
+        self.face_ids = face_ids
+        self.list_ids = list_ids
+        self._save()
+        return list_ids, trained
+
+    def _train(self, embeddings: EmbeddingMatrix) -> np.ndarray:
+        """Spherical k-means on a random sample of the faces"""
+        n_faces = len(embeddings)
+        n_lists = min(list_count_for(n_faces), n_faces)
+        rng = np.random.default_rng()
+
+        sample_rows = np.sort(rng.choice(n_faces, min(n_faces, n_lists * TRAIN_SAMPLES_PER_LIST), replace=False))
+        sample = _unit_rows(embeddings, sample_rows)
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)]
+
+        for _ in range(KMEANS_ITERATIONS):
+            assignment = self._nearest(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+
+            # An empty list is reseeded with a random sample face
+            empty = np.bincount(assignment, minlength=n_lists) == 0
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+            centroids = sums / np.linalg.norm(sums, axis=1, keepdims=True)
+
+        return centroids.astype(np.float32)
+
+    @staticmethod
+    def _nearest(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        return np.concatenate([
+            np.argmax(vectors[start:start + ASSIGN_CHUNK] @ centroids.T, axis=1)
+            for start in range(0, len(vectors), ASSIGN_CHUNK)
+        ]).astype(np.int32)
+
+    def _assign(self, embeddings: EmbeddingMatrix, rows: np.ndarray) -> np.ndarray:
+        return np.concatenate([
+            self._nearest(_unit_rows(embeddings, rows[start:start + ASSIGN_CHUNK]), self.centroids)
+            for start in range(0, len(rows), ASSIGN_CHUNK)
+        ])
+
+    def probe_lists(self, n_probe: int) -> np.ndarray:
+        """For every list, the n_probe lists with the nearest centroids, itself first"""
+        similarities = self.centroids @ self.centroids.T
+        np.fill_diagonal(similarities, np.inf)
+        n_probe = min(n_probe, len(self.centroids))
+        nearest = np.argpartition(-similarities, n_probe - 1, axis=1)[:, :n_probe]
+        order = np.argsort(-np.take_along_axis(similarities, nearest, axis=1), axis=1)
+        return np.take_along_axis(nearest, order, axis=1)
@@ -12,11 +12,15 @@ import webview
 import pystray
 from pystray import MenuItem as item
 
-from utils import get_appdata_path, create_tray_icon
+from utils import get_appdata_path, get_insightface_root, create_tray_icon
 from database import FaceDatabase
 from thumbnail_cache import ThumbnailCache
 from settings import Settings
 from workers import ScanWorker, ClusterWorker
+from folder_watcher import FolderWatcher
+from event_bus import UIEventBus
+from embedding_store import measure_precision, format_precision_report
+from face_engine import MODEL_PACKS
 
 
 class API:
@@ -31,11 +35,15 @@ class API:
         self._window = None
         self._scan_worker = None
         self._cluster_worker = None
+        self._cluster_lock = threading.Lock()
+        self._recluster_pending = False
+        self._folder_watcher = None
         self._tray_icon = None
         self._close_to_tray = settings.get('close_to_tray', True)
         self._quit_flag = False
         self._dynamic_resources = settings.get('dynamic_resources', True)
         self._window_foreground = True
+        self._event_bus = UIEventBus(lambda: self._window)
 
         cache_path = db_path.parent / "thumbnail_cache"
         self._thumbnail_cache = ThumbnailCache(str(cache_path))
@@ -121,14 +129,10 @@ class API:
         tray_thread.start()
     
     def update_status(self, message: str):
-        if self._window:
-            safe_message = message.replace('"', '\\"').replace('\n', ' ')
-            self._window.evaluate_js(f'updateStatusMessage("{safe_message}")')
+        self._event_bus.post_status(message)
     
     def update_progress(self, current: int, total: int):
-        if self._window:
-            percent = (current / total) * 100 if total > 0 else 0
-            self._window.evaluate_js(f'updateProgress({current}, {total}, {percent})')
+        self._event_bus.post_progress(current, total)
 
     def get_cache_stats(self):
         return self._thumbnail_cache.get_cache_size()
@@ -139,7 +143,12 @@ class API:
             self._window.evaluate_js('loadPeople()')
         return stats
     
-    def scan_complete(self):
+    def scan_complete(self, quiet=False):
+        if quiet:
+            # A background scan that found nothing to do stays out of the log and the People view
+            self._settings.set('last_scan_time', time.time())
+            return
+        
         total_faces = self._db.get_total_faces()
         total_photos = self._db.get_total_photos()
         pending_count = self._db.get_photos_needing_scan()
@@ -149,6 +158,10 @@ class API:
         if pending_count > 0:
             self.update_status(f"Warning: {pending_count} photos had errors and were skipped")
         
+        quarantined_count = len(self._db.get_quarantined_photos())
+        if quarantined_count > 0:
+            self.update_status(f"{quarantined_count} photos failed repeatedly and are quarantined - see Settings > Folders to Scan")
+        
         self._settings.set('last_scan_time', time.time())
         
         active_clustering = self._db.get_active_clustering()
@@ -174,6 +187,7 @@ class API:
         self._photos_deleted = deleted
     
     def cluster_complete(self):
+        self._event_bus.flush()
         if self._window:
             self._window.evaluate_js('hideProgress()')
             self._window.evaluate_js('loadPeople()')
@@ -212,16 +226,61 @@ class API:
         
         return True
     
-    def start_scanning(self):
+    def start_scanning(self, full_rescan=False, changes=None, background=False):
+        # Background scans from the folder watcher wait for clustering, which uses the same
+        # database connection; the watcher tries again on its next tick
+        if background and self.is_clustering():
+            return False
         if self._scan_worker is None or not self._scan_worker.is_alive():
-            self._scan_worker = ScanWorker(self._db, self)
+            self._scan_worker = ScanWorker(
+                self._db, self, full_rescan=full_rescan, changes=changes, quiet=background
+            )
             self._scan_worker.start()
+            return True
+        return False
+    
+    def _update_folder_watcher(self):
+        if self._folder_watcher:
+            self._folder_watcher.stop()
+            self._folder_watcher = None
+        
+        include_folders = self.get_include_folders()
+        if not self._settings.get('watch_folders', False) or not include_folders:
+            return
+        
+        self._folder_watcher = FolderWatcher(self, include_folders)
+        self._folder_watcher.start()
+        
+        if self._folder_watcher.mode == 'native':
+            self.update_status("Watching folders for new and changed photos")
+        else:
+            self.update_status("Watching folders by polling every 5 minutes (install watchdog for instant updates)")
     
     def start_clustering(self):
-        if self._cluster_worker is None or not self._cluster_worker.is_alive():
-            threshold = self.get_threshold()
-            self._cluster_worker = ClusterWorker(self._db, threshold, self)
-            self._cluster_worker.start()
+        with self._cluster_lock:
+            if self._cluster_worker is None or not self._cluster_worker.is_alive():
+                self._start_cluster_worker()
+            elif not self._recluster_pending:
+                self._recluster_pending = True
+                self.update_status("Clustering is running, it will run again when it finishes")
+    
+    def _start_cluster_worker(self):
+        self._cluster_worker = ClusterWorker(self._db, self.get_threshold(), self)
+        self._cluster_worker.start()
+    
+    def is_clustering(self) -> bool:
+        with self._cluster_lock:
+            return self._cluster_worker is not None and self._cluster_worker.is_alive()
+    
+    def clustering_finished(self):
+        """Called by the cluster worker as it exits; a clustering requested while it ran,
+        for faces found by a scan or a new threshold, starts now"""
+        with self._cluster_lock:
+            if self._recluster_pending:
+                self._recluster_pending = False
+                self._start_cluster_worker()
+            else:
+                self._cluster_worker = None
     
     def get_threshold(self):
         return self._threshold
@@ -615,6 +674,8 @@ class API:
         
         self.update_status(f"Database status: {total_photos} photos scanned, {total_faces} faces detected")
         
+        self._update_folder_watcher()
+        
         if self.should_scan_on_startup():
             scan_frequency = self._settings.get('scan_frequency', 'restart_1_day')
             
@@ -649,6 +710,114 @@ class API:
     def set_scan_frequency(self, frequency):
         self._settings.set('scan_frequency', frequency)
     
+    def get_watch_folders(self):
+        return self._settings.get('watch_folders', False)
+    
+    def set_watch_folders(self, enabled):
+        self._settings.set('watch_folders', enabled)
+        self._update_folder_watcher()
+    
+    def get_detection_mode(self):
+        return self._settings.get('detection_mode', 'full')
+    
+    def set_detection_mode(self, mode):
+        self._settings.set('detection_mode', mode)
+    
+    def get_model_pack(self):
+        return self._settings.get('model_pack', 'buffalo_l')
+    
+    def get_available_model_packs(self):
+        """The frozen build only has the packs bundled with it, a script install downloads
+        a missing pack on first use"""
+        if not getattr(sys, 'frozen', False):
+            return list(MODEL_PACKS)
+        models_root = Path(get_insightface_root()) / "models"
+        return [pack for pack in MODEL_PACKS if (models_root / pack).is_dir()]
+    
+    def set_model_pack(self, model_pack):
+        if model_pack == self.get_model_pack():
+            return {'success': True}
+        
+        if model_pack not in self.get_available_model_packs():
+            return {'success': False, 'message': f'{model_pack} is not included in this installation.'}
+        
+        total_faces = self._db.get_total_faces()
+        if total_faces > 0:
+            return {
+                'success': False,
+                'message': f'{total_faces} faces were already detected with {self.get_model_pack()}. '
+                           'Faces from different model packs cannot be matched, clear the database to switch.'
+            }
+        
+        self._settings.set('model_pack', model_pack)
+        self._db.set_meta('model_pack', model_pack)
+        return {'success': True}
+    
+    def get_embedding_precision(self):
+        return self._settings.get('embedding_precision', 'float32')
+    
+    def set_embedding_precision(self, precision):
+        # The store is rebuilt in the new precision from LMDB on the next clustering
+        self._settings.set('embedding_precision', precision)
+    
+    def get_embedding_precision_report(self):
+        """Accuracy of each reduced precision on a sample of the stored faces"""
+        sample = self._db.sample_embeddings(2000)
+        if len(sample) < 2:
+            return ['Not enough faces yet to measure embedding precision']
+        
+        edge_threshold = self._threshold / 100.0 + 0.05
+        return [
+            format_precision_report(measure_precision(sample, precision, edge_threshold))
+            for precision in ('float16', 'int8')
+        ]
+    
+    def get_cluster_graph(self):
+        return self._settings.get('cluster_graph', 'auto')
+    
+    def set_cluster_graph(self, mode):
+        self._settings.set('cluster_graph', mode)
+    
+    def get_scan_workers(self):
+        return self._settings.get('scan_workers', 0)
+    
+    def set_scan_workers(self, count):
+        self._settings.set('scan_workers', int(count))
+    
+    def get_scan_pipeline_config(self):
+        return {
+            'io_threads': self._settings.get('scan_io_threads', 4),
+            'decode_threads': self._settings.get('scan_decode_threads', 2),
+            'queue_size': self._settings.get('scan_queue_size', 8),
+            'discovery_threads': self._settings.get('discovery_threads', 8),
+            'detection_mode': self._settings.get('detection_mode', 'full')
+        }
+    
+    def get_quarantined_photos(self):
+        return self._db.get_quarantined_photos()
+    
+    def retry_quarantined_photos(self):
+        count = self._db.release_quarantined_photos()
+        # A scan already running read the photo list before the release and skips them
+        if self.start_scanning():
+            self.update_status(f"Released {count} quarantined photos, retrying them now")
+        else:
+            self.update_status(f"Released {count} quarantined photos, they will be retried on the next scan")
+        return count
+    
+    def get_cluster_config(self):
+        return {
+            # 0 keeps every edge above the threshold, otherwise each face keeps its strongest ones
+            'max_neighbors': self._settings.get('cluster_max_neighbors', 0),
+            'graph_mode': self._settings.get('cluster_graph', 'auto'),
+            'ann_probes': self._settings.get('ann_probes', 8)
+        }
+    
+    def get_scan_queue_depths(self):
+        if self._scan_worker is None or not self._scan_worker.is_alive():
+            return {}
+        return self._scan_worker.get_queue_depths()
+    
     def get_close_to_tray(self):
         return self._close_to_tray
     
@@ -673,10 +842,16 @@ class API:
         self._dynamic_resources = enabled
         self._settings.set('dynamic_resources', enabled)
         if enabled:
-            self.update_status("Dynamic resource management enabled - will throttle when in background")
+            self.update_status("Dynamic resource management enabled - will throttle in background when the system is busy")
         else:
             self.update_status("Dynamic resource management disabled - full speed always")
     
+    def get_cpu_budget(self):
+        return self._settings.get('cpu_budget', 50)
+    
+    def set_cpu_budget(self, percent):
+        self._settings.set('cpu_budget', int(percent))
+    
     def get_show_unmatched(self):
         return self._settings.get('show_unmatched', False)
     
@@ -724,6 +899,8 @@ class API:
     
     def set_include_folders(self, folders):
         self._settings.set('include_folders', folders)
+        if self._folder_watcher:
+            self._update_folder_watcher()
     
     def get_exclude_folders(self):
         return self._settings.get('exclude_folders', [])
@@ -877,6 +1054,9 @@ class API:
         self._settings.set('show_face_tags_preview', enabled)
     
     def close(self):
+        self._event_bus.stop()
+        if self._folder_watcher:
+            self._folder_watcher.stop()
         if self._tray_icon:
             try:
                 self._tray_icon.stop()
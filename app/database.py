@@ -1,12 +1,29 @@
 import sqlite3
 import lmdb
 import pickle
+import json
+import time
+import struct
 import threading
 from pathlib import Path
 from typing import List, Optional, Tuple, Set, Dict
 from collections import Counter
 import numpy as np
 
+from embedding_store import EmbeddingStore, EmbeddingMatrix, DEFAULT_PRECISION
+from ann_index import IVFIndex
+
+# Embeddings live in a named LMDB database whose name carries the format version. Keys
+# are 8 byte big-endian face ids, so a cursor walks them in face id order, and values
+# are raw little-endian float32 vectors
+EMBEDDINGS_DB_NAME = b'embeddings_v1'
+EMBEDDING_DTYPE = np.dtype('<f4')
+MIGRATION_CHUNK = 10000
+
+
+def _embedding_key(face_id: int) -> bytes:
+    return struct.pack('>Q', face_id)
+
 
 class FaceDatabase:
     def __init__(self, db_folder: str):
@@ -23,12 +40,18 @@ class FaceDatabase:
         self.env = lmdb.open(
             str(self.lmdb_path),
             map_size=10*1024*1024*1024,
-            max_dbs=1,
+            max_dbs=4,
             readahead=True,
             metasync=False,
             sync=False,
             writemap=True
         )
+        self.embeddings_db = self.env.open_db(EMBEDDINGS_DB_NAME)
+        self._migrate_pickled_embeddings()
+        
+        # Memory-mapped copy of the LMDB embeddings for bulk reads by clustering
+        self.embedding_store = EmbeddingStore(self.db_folder / "embedding_store")
+        self.ann_index = IVFIndex(self.db_folder / "ann_index")
         
         self._init_tables()
         self._temp_table_counter = 0
@@ -70,7 +93,12 @@ class FaceDatabase:
                 file_path TEXT UNIQUE NOT NULL,
                 file_hash TEXT,
                 scan_status TEXT DEFAULT 'pending',
-                date_added REAL DEFAULT (julianday('now'))
+                date_added REAL DEFAULT (julianday('now')),
+                file_size INTEGER,
+                file_mtime_ns INTEGER,
+                file_inode INTEGER,
+                error_count INTEGER DEFAULT 0,
+                last_attempt REAL
             )
         ''')
         
@@ -144,6 +172,45 @@ class FaceDatabase:
             )
         ''')
         
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS scan_directories (
+                dir_path TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                subdirs TEXT NOT NULL,
+                files TEXT NOT NULL
+            )
+        ''')
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS db_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        ''')
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS scan_runs (
+                run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                started_at REAL DEFAULT (julianday('now')),
+                finished_at REAL,
+                status TEXT DEFAULT 'running',
+                rules TEXT,
+                moves TEXT
+            )
+        ''')
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS scan_run_items (
+                run_id INTEGER NOT NULL,
+                file_path TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                photo_id INTEGER,
+                done INTEGER DEFAULT 0,
+                PRIMARY KEY (run_id, file_path),
+                FOREIGN KEY (run_id) REFERENCES scan_runs(run_id)
+            )
+        ''')
+        
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_photos_status ON photos(scan_status)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_photos_path ON photos(file_path)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_photos_hash ON photos(file_hash)')
@@ -159,6 +226,8 @@ class FaceDatabase:
         self.conn.commit()
         
         self._migrate_add_is_manual_column(cursor)
+        self._migrate_add_fingerprint_columns(cursor)
+        self._migrate_add_retry_columns(cursor)
     
     def _migrate_add_is_manual_column(self, cursor):
         try:
@@ -173,6 +242,67 @@ class FaceDatabase:
         except Exception as e:
             print(f"Migration error (non-critical): {e}")
     
+    def _migrate_add_fingerprint_columns(self, cursor):
+        try:
+            cursor.execute("PRAGMA table_info(photos)")
+            columns = [row[1] for row in cursor.fetchall()]
+            
+            for column in ('file_size', 'file_mtime_ns', 'file_inode'):
+                if column not in columns:
+                    print(f"Migrating database: Adding '{column}' column to photos...")
+                    cursor.execute(f'ALTER TABLE photos ADD COLUMN {column} INTEGER')
+            self.conn.commit()
+        except Exception as e:
+            print(f"Migration error (non-critical): {e}")
+    
+    def _migrate_add_retry_columns(self, cursor):
+        try:
+            cursor.execute("PRAGMA table_info(photos)")
+            columns = [row[1] for row in cursor.fetchall()]
+            
+            if 'error_count' not in columns:
+                print("Migrating database: Adding 'error_count' column to photos...")
+                cursor.execute('ALTER TABLE photos ADD COLUMN error_count INTEGER DEFAULT 0')
+            if 'last_attempt' not in columns:
+                print("Migrating database: Adding 'last_attempt' column to photos...")
+                cursor.execute('ALTER TABLE photos ADD COLUMN last_attempt REAL')
+            self.conn.commit()
+        except Exception as e:
+            print(f"Migration error (non-critical): {e}")
+    
+    def _migrate_pickled_embeddings(self):
+        """Moves embeddings pickled under decimal keys in the main database to the binary format.
+
+        Named databases are listed in the main database too, but under names that sort after
+        the digits, so the legacy entries are exactly the leading run of digit keys. Each
+        chunk is its own transaction, an interrupted migration continues on the next start.
+        """
+        migrated = 0
+        while True:
+            with self.env.begin(write=True) as txn:
+                legacy = []
+                cursor = txn.cursor()
+                for key, value in cursor:
+                    if not key.isdigit():
+                        break
+                    legacy.append((key, value))
+                    if len(legacy) >= MIGRATION_CHUNK:
+                        break
+                
+                if not legacy:
+                    break
+                if migrated == 0:
+                    print("Migrating embeddings to the binary format...")
+                
+                for key, value in legacy:
+                    embedding = np.asarray(pickle.loads(value), dtype=EMBEDDING_DTYPE)
+                    txn.put(_embedding_key(int(key)), embedding.tobytes(), db=self.embeddings_db)
+                    txn.delete(key)
+                migrated += len(legacy)
+        
+        if migrated:
+            print(f"Migration complete: {migrated} embeddings converted")
+    
     def _get_temp_table_name(self) -> str:
         self._temp_table_counter += 1
         return f"temp_ids_{self._temp_table_counter}"
@@ -228,79 +358,246 @@ class FaceDatabase:
             except Exception as e:
                 print(f"Warning: Failed to drop temp table {temp_table}: {e}")
     
-    def add_photo(self, file_path: str, file_hash: str) -> Optional[int]:
-        cursor = self.conn.cursor()
-        try:
-            cursor.execute('''
-                INSERT OR IGNORE INTO photos (file_path, file_hash)
-                VALUES (?, ?)
-            ''', (file_path, file_hash))
-            self.conn.commit()
-            
-            if cursor.lastrowid:
-                return cursor.lastrowid
-            
-            return self.get_photo_id(file_path)
-        except Exception as e:
-            print(f"Database error in add_photo: {e}")
-            self.conn.rollback()
-            return None
-    
     def get_photo_id(self, file_path: str) -> Optional[int]:
         cursor = self.conn.cursor()
         cursor.execute('SELECT photo_id FROM photos WHERE file_path = ?', (file_path,))
         row = cursor.fetchone()
         return row[0] if row else None
     
-    def get_all_scanned_paths(self) -> Set[str]:
+    def get_photo_fingerprints(self) -> Dict[str, dict]:
         cursor = self.conn.cursor()
-        cursor.execute('SELECT file_path FROM photos WHERE scan_status = "completed"')
-        return {row[0] for row in cursor.fetchall()}
+        cursor.execute('''
+            SELECT photo_id, file_path, file_hash, scan_status, file_size, file_mtime_ns, file_inode,
+                   error_count, last_attempt
+            FROM photos
+        ''')
+        return {row['file_path']: dict(row) for row in cursor.fetchall()}
     
-    def get_pending_and_error_paths(self) -> List[str]:
+    def get_quarantined_photos(self) -> List[dict]:
         cursor = self.conn.cursor()
         cursor.execute('''
-            SELECT file_path FROM photos 
-            WHERE scan_status IN ("pending", "error")
+            SELECT photo_id, file_path, error_count, last_attempt FROM photos
+            WHERE scan_status = 'quarantined'
+            ORDER BY file_path
         ''')
-        return [row[0] for row in cursor.fetchall()]
+        return [dict(row) for row in cursor.fetchall()]
+    
+    def release_quarantined_photos(self) -> int:
+        """Gives every quarantined photo a fresh set of retries on the next scan"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            UPDATE photos SET scan_status = 'error', error_count = 0, last_attempt = NULL
+            WHERE scan_status = 'quarantined'
+        ''')
+        self.conn.commit()
+        return cursor.rowcount
+    
+    def update_fingerprints(self, fingerprints: List[Tuple[int, Tuple[int, int, int]]]):
+        cursor = self.conn.cursor()
+        cursor.executemany('''
+            UPDATE photos SET file_size = ?, file_mtime_ns = ?, file_inode = ?
+            WHERE photo_id = ?
+        ''', [(size, mtime_ns, inode, photo_id) for photo_id, (size, mtime_ns, inode) in fingerprints])
+        self.conn.commit()
+    
+    def get_meta(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT value FROM db_meta WHERE key = ?', (key,))
+        row = cursor.fetchone()
+        return row[0] if row else default
+    
+    def set_meta(self, key: str, value: Optional[str]):
+        cursor = self.conn.cursor()
+        cursor.execute('INSERT OR REPLACE INTO db_meta (key, value) VALUES (?, ?)', (key, value))
+        self.conn.commit()
+    
+    def get_directory_index(self) -> Dict[str, dict]:
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT dir_path, mtime_ns, subdirs, files FROM scan_directories')
+        return {
+            row[0]: {'mtime_ns': row[1], 'subdirs': json.loads(row[2]), 'files': json.loads(row[3])}
+            for row in cursor.fetchall()
+        }
+    
+    def _write_directory_index(self, cursor, directories: Dict[str, dict]):
+        # Only folders that changed since the last scan are written, most scans touch a handful of rows
+        cursor.execute('SELECT dir_path, mtime_ns, subdirs, files FROM scan_directories')
+        stored = {row[0]: row[1:] for row in cursor.fetchall()}
+        rows = {
+            dir_path: (entry['mtime_ns'], json.dumps(entry['subdirs']), json.dumps(entry['files']))
+            for dir_path, entry in directories.items()
+        }
+        
+        # Folders that were deleted or excluded drop out of the index
+        cursor.executemany('DELETE FROM scan_directories WHERE dir_path = ?', [
+            (dir_path,) for dir_path in stored.keys() - rows.keys()
+        ])
+        cursor.executemany('''
+            INSERT OR REPLACE INTO scan_directories (dir_path, mtime_ns, subdirs, files)
+            VALUES (?, ?, ?, ?)
+        ''', [
+            (dir_path, *row) for dir_path, row in rows.items()
+            if stored.get(dir_path) != row
+        ])
+    
+    def start_scan_run(self, rules: str) -> int:
+        """Opens a journal for a full scan, abandoning any run that can no longer be resumed.
+        
+        Only the latest run is kept, earlier ones are either completed or abandoned here
+        and nothing reads them again.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute('DELETE FROM scan_run_items')
+        cursor.execute('DELETE FROM scan_runs')
+        cursor.execute('INSERT INTO scan_runs (rules) VALUES (?)', (rules,))
+        run_id = cursor.lastrowid
+        self.conn.commit()
+        return run_id
+    
+    def get_resumable_scan_run(self, rules: str) -> Optional[dict]:
+        """An unfinished run whose discovery completed under the same folder rules"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT run_id, moves FROM scan_runs
+            WHERE status = 'running' AND rules = ? AND moves IS NOT NULL
+            ORDER BY run_id DESC LIMIT 1
+        ''', (rules,))
+        row = cursor.fetchone()
+        if not row:
+            return None
+        return {'run_id': row[0], 'moves': json.loads(row[1])}
+    
+    def get_scan_run_items(self, run_id: int) -> List[dict]:
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT file_path, kind, photo_id, done FROM scan_run_items WHERE run_id = ?
+        ''', (run_id,))
+        return [
+            {'file_path': row[0], 'kind': row[1], 'photo_id': row[2], 'done': bool(row[3])}
+            for row in cursor.fetchall()
+        ]
+    
+    def save_scan_journal(self, run_id: int, items: List[dict], moves: List[tuple], done_paths: Set[str],
+                          directories: Dict[str, dict], rules: str):
+        """Records the complete work list of a run once discovery has finished.
+        
+        The directory index is written in the same transaction, so a resumed run can
+        rebuild the set of files that exist without walking the folders again.
+        """
+        cursor = self.conn.cursor()
+        try:
+            cursor.executemany('''
+                INSERT OR REPLACE INTO scan_run_items (run_id, file_path, kind, photo_id, done)
+                VALUES (?, ?, ?, ?, ?)
+            ''', [
+                (run_id, item['file_path'], item['kind'], item['photo_id'], int(item['file_path'] in done_paths))
+                for item in items
+            ])
+            cursor.execute(
+                'UPDATE scan_runs SET moves = ? WHERE run_id = ?',
+                (json.dumps([[photo_id, path, list(fingerprint)] for photo_id, path, fingerprint in moves]), run_id)
+            )
+            self._write_directory_index(cursor, directories)
+            cursor.execute(
+                'INSERT OR REPLACE INTO db_meta (key, value) VALUES (?, ?)',
+                ('directory_index_rules', rules)
+            )
+            self.conn.commit()
+        except Exception as e:
+            print(f"Database error in save_scan_journal: {e}")
+            self.conn.rollback()
+    
+    def finish_scan_run(self, run_id: int):
+        cursor = self.conn.cursor()
+        cursor.execute(
+            "UPDATE scan_runs SET status = 'completed', finished_at = julianday('now') WHERE run_id = ?",
+            (run_id,)
+        )
+        cursor.execute('DELETE FROM scan_run_items WHERE run_id = ?', (run_id,))
+        self.conn.commit()
+    
+    def relocate_photos(self, moves: List[Tuple[int, str, Tuple[int, int, int]]]):
+        """Points existing photo rows at their new path so faces, tags and clusters are kept"""
+        cursor = self.conn.cursor()
+        cursor.executemany('''
+            UPDATE photos SET file_path = ?, file_size = ?, file_mtime_ns = ?, file_inode = ?
+            WHERE photo_id = ?
+        ''', [(new_path, size, mtime_ns, inode, photo_id) for photo_id, new_path, (size, mtime_ns, inode) in moves])
+        self.conn.commit()
+    
+    def _delete_faces_of_photos(self, cursor, photo_ids: List[int], txn=None):
+        rows = self._execute_with_temp_table(
+            cursor, photo_ids,
+            'SELECT face_id FROM faces WHERE photo_id IN (SELECT id FROM {temp_table})',
+            fetch_results=True
+        )
+        deleted_face_ids = [row[0] for row in rows]
+        
+        if deleted_face_ids:
+            self._execute_with_temp_table(
+                cursor, deleted_face_ids,
+                'DELETE FROM face_tags WHERE face_id IN (SELECT id FROM {temp_table})'
+            )
+            self._execute_with_temp_table(
+                cursor, deleted_face_ids,
+                'DELETE FROM tag_primary_photos WHERE face_id IN (SELECT id FROM {temp_table})'
+            )
+            self._execute_with_temp_table(
+                cursor, deleted_face_ids,
+                'DELETE FROM hidden_photos WHERE face_id IN (SELECT id FROM {temp_table})'
+            )
+        
+        self._execute_with_temp_table(
+            cursor, photo_ids,
+            'DELETE FROM faces WHERE photo_id IN (SELECT id FROM {temp_table})'
+        )
+        
+        if txn is not None:
+            for face_id in deleted_face_ids:
+                txn.delete(_embedding_key(face_id), db=self.embeddings_db)
+        else:
+            with self.env.begin(write=True) as txn:
+                for face_id in deleted_face_ids:
+                    txn.delete(_embedding_key(face_id), db=self.embeddings_db)
+        
+        return deleted_face_ids
     
     def remove_deleted_photos(self, existing_paths: Set[str]) -> int:
         cursor = self.conn.cursor()
         cursor.execute('SELECT photo_id, file_path FROM photos')
         all_db_photos = cursor.fetchall()
         
-        deleted_count = 0
         deleted_photo_ids = []
         for photo_id, file_path in all_db_photos:
             if file_path not in existing_paths:
                 deleted_photo_ids.append(photo_id)
-                deleted_count += 1
         
-        if deleted_photo_ids:
-            cursor.execute(f'SELECT face_id FROM faces WHERE photo_id IN ({",".join("?" * len(deleted_photo_ids))})', deleted_photo_ids)
-            deleted_face_ids = [row[0] for row in cursor.fetchall()]
-            
-            if deleted_face_ids:
-                self._execute_with_temp_table(
-                    cursor, deleted_face_ids,
-                    'DELETE FROM face_tags WHERE face_id IN (SELECT id FROM {temp_table})'
-                )
-                self._execute_with_temp_table(
-                    cursor, deleted_face_ids,
-                    'DELETE FROM tag_primary_photos WHERE face_id IN (SELECT id FROM {temp_table})'
-                )
-                self._execute_with_temp_table(
-                    cursor, deleted_face_ids,
-                    'DELETE FROM hidden_photos WHERE face_id IN (SELECT id FROM {temp_table})'
-                )
-            
-            placeholders = ','.join('?' * len(deleted_photo_ids))
-            cursor.execute(f'DELETE FROM faces WHERE photo_id IN ({placeholders})', deleted_photo_ids)
-            cursor.execute(f'DELETE FROM photos WHERE photo_id IN ({placeholders})', deleted_photo_ids)
+        return self.remove_photos(deleted_photo_ids)
+    
+    def remove_photos(self, photo_ids: List[int]) -> int:
+        cursor = self.conn.cursor()
+        
+        deleted_face_ids = []
+        if photo_ids:
+            deleted_face_ids = self._delete_faces_of_photos(cursor, photo_ids)
+            self._execute_with_temp_table(
+                cursor, photo_ids,
+                'DELETE FROM photos WHERE photo_id IN (SELECT id FROM {temp_table})'
+            )
         
         self.conn.commit()
-        return deleted_count
+        self._update_embedding_store([], [], deleted_face_ids)
+        return len(photo_ids)
+    
+    def _update_embedding_store(self, face_ids: List[int], embeddings: List[np.ndarray], deleted_face_ids: List[int]):
+        """Mirrors committed changes into the mapped store; if this fails, the next bulk
+        load finds the store out of step with LMDB and rebuilds it"""
+        try:
+            self.embedding_store.remove(deleted_face_ids)
+            if face_ids:
+                self.embedding_store.append(face_ids, np.vstack(embeddings))
+        except Exception as e:
+            print(f"Embedding store update failed: {e}")
     
     def get_photos_needing_scan(self) -> int:
         cursor = self.conn.cursor()
@@ -310,46 +607,199 @@ class FaceDatabase:
         ''')
         return cursor.fetchone()[0]
     
-    def add_face(self, photo_id: int, embedding: np.ndarray, bbox: List[float]) -> int:
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            INSERT INTO faces (photo_id, bbox_x1, bbox_y1, bbox_x2, bbox_y2) 
-            VALUES (?, ?, ?, ?, ?)
-        ''', (photo_id, bbox[0], bbox[1], bbox[2], bbox[3]))
-        self.conn.commit()
-        face_id = cursor.lastrowid
+    def commit_scan_batch(self, photos: List[dict], run_id: Optional[int] = None) -> Dict[str, int]:
+        """Writes a batch of scanned photos with one SQLite commit and one LMDB transaction.
         
-        with self.env.begin(write=True) as txn:
-            key = str(face_id).encode()
-            value = pickle.dumps(embedding)
-            txn.put(key, value)
+        Each entry has file_path, file_hash, fingerprint, status, faces and error_count, plus
+        an optional reset_photo_id whose old faces are dropped first. With a run_id the photos
+        are also ticked off in that scan's journal. Returns photo ids by path.
+        """
+        cursor = self.conn.cursor()
         
-        return face_id
+        try:
+            with self.env.begin(write=True) as txn:
+                reset_ids = [p['reset_photo_id'] for p in photos if p.get('reset_photo_id') is not None]
+                deleted_face_ids = []
+                if reset_ids:
+                    deleted_face_ids = self._delete_faces_of_photos(cursor, reset_ids, txn)
+                
+                attempt_time = time.time()
+                photo_rows = []
+                for photo in photos:
+                    size, mtime_ns, inode = photo['fingerprint'] if photo.get('fingerprint') else (None, None, None)
+                    photo_rows.append((
+                        photo['file_path'], photo['file_hash'], photo['status'], size, mtime_ns, inode,
+                        photo.get('error_count', 0), attempt_time
+                    ))
+                
+                cursor.executemany('''
+                    INSERT INTO photos (file_path, file_hash, scan_status, file_size, file_mtime_ns, file_inode,
+                                        error_count, last_attempt)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(file_path) DO UPDATE SET
+                        file_hash = excluded.file_hash,
+                        scan_status = excluded.scan_status,
+                        file_size = excluded.file_size,
+                        file_mtime_ns = excluded.file_mtime_ns,
+                        file_inode = excluded.file_inode,
+                        error_count = excluded.error_count,
+                        last_attempt = excluded.last_attempt
+                ''', photo_rows)
+                
+                paths = [photo['file_path'] for photo in photos]
+                photo_ids = {}
+                for i in range(0, len(paths), 900):
+                    chunk = paths[i:i+900]
+                    placeholders = ','.join('?' * len(chunk))
+                    cursor.execute(f'SELECT file_path, photo_id FROM photos WHERE file_path IN ({placeholders})', chunk)
+                    photo_ids.update({row[0]: row[1] for row in cursor.fetchall()})
+                
+                # Ids are allocated here rather than read back from lastrowid, so every face
+                # goes in with one executemany and its embedding key is known up front
+                cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'faces'")
+                row = cursor.fetchone()
+                next_face_id = (row[0] if row else 0) + 1
+                
+                face_rows = []
+                new_face_ids = []
+                new_embeddings = []
+                for photo in photos:
+                    photo_id = photo_ids[photo['file_path']]
+                    for face in photo['faces']:
+                        bbox = face['bbox']
+                        face_rows.append((next_face_id, photo_id, bbox[0], bbox[1], bbox[2], bbox[3]))
+                        embedding = np.asarray(face['embedding'], dtype=EMBEDDING_DTYPE)
+                        txn.put(_embedding_key(next_face_id), embedding.tobytes(), db=self.embeddings_db)
+                        new_face_ids.append(next_face_id)
+                        new_embeddings.append(embedding)
+                        next_face_id += 1
+                
+                cursor.executemany('''
+                    INSERT INTO faces (face_id, photo_id, bbox_x1, bbox_y1, bbox_x2, bbox_y2)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', face_rows)
+                
+                if run_id is not None:
+                    cursor.executemany(
+                        'UPDATE scan_run_items SET done = 1 WHERE run_id = ? AND file_path = ?',
+                        [(run_id, path) for path in paths]
+                    )
+            
+            # LMDB commits first, a failure there leaves no faces without embeddings
+            self.conn.commit()
+            self._update_embedding_store(new_face_ids, new_embeddings, deleted_face_ids)
+            return photo_ids
+        except Exception as e:
+            print(f"Database error in commit_scan_batch: {e}")
+            self.conn.rollback()
+            raise
+    
+    def get_completed_hash_index(self) -> Dict[str, int]:
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT file_hash, MIN(photo_id) FROM photos
+            WHERE scan_status = "completed" AND file_hash IS NOT NULL
+            GROUP BY file_hash
+        ''')
+        return {row[0]: row[1] for row in cursor.fetchall()}
+    
+    def get_photo_faces_with_embeddings(self, photo_id: int) -> Optional[List[dict]]:
+        """Returns None if any embedding is missing, so callers never clone a partial photo"""
+        conn = self._get_connection()
+        rows = conn.execute('''
+            SELECT face_id, bbox_x1, bbox_y1, bbox_x2, bbox_y2 FROM faces
+            WHERE photo_id = ?
+            ORDER BY face_id
+        ''', (photo_id,)).fetchall()
+        
+        faces = []
+        with self.env.begin(db=self.embeddings_db) as txn:
+            for row in rows:
+                value = txn.get(_embedding_key(row[0]))
+                if value is None:
+                    return None
+                faces.append({
+                    'embedding': np.frombuffer(value, dtype=EMBEDDING_DTYPE),
+                    'bbox': [row[1], row[2], row[3], row[4]]
+                })
+        return faces
     
     def get_face_embedding(self, face_id: int) -> Optional[np.ndarray]:
-        with self.env.begin() as txn:
-            key = str(face_id).encode()
-            value = txn.get(key)
-            if value:
-                return pickle.loads(value)
+        with self.env.begin(db=self.embeddings_db) as txn:
+            value = txn.get(_embedding_key(face_id))
+            if value is not None:
+                return np.frombuffer(value, dtype=EMBEDDING_DTYPE)
         return None
     
-    def get_all_embeddings(self) -> Tuple[List[int], np.ndarray]:
+    def _read_all_embeddings(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Reads every embedding with one cursor scan straight into a preallocated matrix"""
+        with self.env.begin(db=self.embeddings_db, buffers=True) as txn:
+            count = txn.stat(self.embeddings_db)['entries']
+            cursor = txn.cursor()
+            if count == 0 or not cursor.first():
+                return np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=EMBEDDING_DTYPE)
+            
+            row_bytes = len(cursor.value())
+            embeddings = np.empty((count, row_bytes // EMBEDDING_DTYPE.itemsize), dtype=EMBEDDING_DTYPE)
+            face_ids = np.empty(count, dtype=np.int64)
+            matrix_bytes = memoryview(embeddings).cast('B')
+            
+            for i, (key, value) in enumerate(cursor.iternext()):
+                face_ids[i] = struct.unpack('>Q', key)[0]
+                matrix_bytes[i * row_bytes:(i + 1) * row_bytes] = value
+        
+        return face_ids, embeddings
+    
+    def get_all_embeddings(self, precision: str = DEFAULT_PRECISION) -> Tuple[List[int], EmbeddingMatrix]:
+        """Returns every face id and embedding, the matrix mapped from the embedding store.
+
+        When the store does not match LMDB, or is in another precision, it is rebuilt from
+        one cursor scan.
+        """
+        with self.env.begin(db=self.embeddings_db) as txn:
+            count = txn.stat(self.embeddings_db)['entries']
+            cursor = txn.cursor()
+            max_face_id = struct.unpack('>Q', cursor.key())[0] if cursor.last() else None
+        
+        if self.embedding_store.matches(count, max_face_id, precision):
+            face_ids, embeddings = self.embedding_store.load()
+        else:
+            face_ids, embeddings = self._read_all_embeddings()
+            try:
+                self.embedding_store.rebuild(face_ids, embeddings, precision)
+                face_ids, embeddings = self.embedding_store.load()
+            except Exception as e:
+                print(f"Embedding store rebuild failed: {e}")
+                embeddings = EmbeddingMatrix(embeddings)
+        
+        if len(face_ids) == 0:
+            return [], embeddings
+        
+        # An embedding can outlive its face row if SQLite failed after LMDB committed
         cursor = self.conn.cursor()
-        cursor.execute('SELECT face_id FROM faces ORDER BY face_id')
-        face_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute('SELECT face_id FROM faces')
+        known = np.fromiter((row[0] for row in cursor.fetchall()), dtype=np.int64)
+        valid = np.isin(face_ids, known)
+        if not valid.all():
+            face_ids, embeddings = face_ids[valid], embeddings.select(valid)
+        
+        return face_ids.tolist(), embeddings
+    
+    def sample_embeddings(self, limit: int) -> np.ndarray:
+        """Up to limit random float32 embeddings, read from LMDB rather than the store"""
+        conn = self._get_connection()
+        face_ids = [row[0] for row in conn.execute(
+            'SELECT face_id FROM faces ORDER BY RANDOM() LIMIT ?', (limit,)
+        ).fetchall()]
         
         embeddings = []
-        valid_face_ids = []
-        for face_id in face_ids:
-            embedding = self.get_face_embedding(face_id)
-            if embedding is not None:
-                embeddings.append(embedding)
-                valid_face_ids.append(face_id)
+        with self.env.begin(db=self.embeddings_db) as txn:
+            for face_id in face_ids:
+                value = txn.get(_embedding_key(face_id))
+                if value is not None:
+                    embeddings.append(np.frombuffer(value, dtype=EMBEDDING_DTYPE))
         
-        if embeddings:
-            return valid_face_ids, np.array(embeddings)
-        return [], np.array([])
+        return np.vstack(embeddings) if embeddings else np.empty((0, 0), dtype=EMBEDDING_DTYPE)
     
     def create_clustering(self, threshold: float) -> int:
         cursor = self.conn.cursor()
@@ -739,12 +1189,6 @@ class FaceDatabase:
             'all_tags': dict(tag_counts)
         }
     
-    def update_photo_status(self, photo_id: int, status: str):
-        cursor = self.conn.cursor()
-        cursor.execute('UPDATE photos SET scan_status = ? WHERE photo_id = ?', 
-                      (status, photo_id))
-        self.conn.commit()
-    
     def get_all_named_people(self, clustering_id: int) -> List[Dict]:
         cursor = self.conn.cursor()
         
@@ -0,0 +1,145 @@
+import os
+import queue
+import threading
+from typing import Callable, Dict, List, Optional
+
+from path_filter import PathFilter
+from utils import get_file_fingerprint
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.gif', '.heic', '.heif'}
+
+
+class PhotoDiscovery:
+    """Walks include folders with os.scandir on a pool of threads, one directory per task.
+
+    With a directory index from the previous scan, a folder whose mtime is unchanged is
+    not listed again: its image files and subfolders come from the index and only the
+    subfolders are visited. Adding, removing or renaming entries updates a folder's
+    mtime, but editing a file in place does not, so the indexed files are still stat'ed
+    for their current fingerprint.
+    """
+
+    def __init__(self, path_filter: PathFilter, directory_index: Optional[Dict[str, dict]],
+                 num_threads: int = 8):
+        self.path_filter = path_filter
+        self.directory_index = directory_index or {}
+        self.num_threads = max(1, num_threads)
+
+        self.directories: Dict[str, dict] = {}
+        self.listed_count = 0
+        self.skipped_count = 0
+
+        self._on_file = None
+        self._visited = set()
+        self._queue = queue.Queue()
+        self._outstanding = 0
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    def run(self, root_folders: List[str], on_file: Callable[[str, tuple], None]):
+        """Calls on_file(path, fingerprint) from the worker threads as files are found"""
+        self._on_file = on_file
+
+        roots = [root for root in root_folders if not self.path_filter.is_excluded(root)]
+        if not roots:
+            return
+
+        for root in roots:
+            self._submit(root)
+
+        threads = []
+        for i in range(self.num_threads):
+            thread = threading.Thread(target=self._worker_loop, daemon=True, name=f"Discovery-{i}")
+            thread.start()
+            threads.append(thread)
+
+        self._done.wait()
+
+        for _ in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join()
+
+    def _submit(self, dir_path: str):
+        # Overlapping include folders would otherwise list the same tree twice. Paths are
+        # only normalized for this check, stored photo paths keep the form they were found in
+        visit_key = os.path.normcase(os.path.normpath(dir_path))
+        with self._lock:
+            if visit_key in self._visited:
+                return
+            self._visited.add(visit_key)
+            self._outstanding += 1
+        self._queue.put(dir_path)
+
+    def _worker_loop(self):
+        while True:
+            dir_path = self._queue.get()
+            if dir_path is None:
+                break
+
+            try:
+                self._scan_directory(dir_path)
+            except Exception as e:
+                print(f"Discovery error in {dir_path}: {e}")
+            finally:
+                with self._lock:
+                    self._outstanding -= 1
+                    if self._outstanding == 0:
+                        self._done.set()
+
+    def _scan_directory(self, dir_path: str):
+        try:
+            mtime_ns = os.stat(dir_path).st_mtime_ns
+        except OSError:
+            return
+
+        cached = self.directory_index.get(dir_path)
+
+        if cached is not None and cached['mtime_ns'] == mtime_ns:
+            subdirs = cached['subdirs']
+            files = cached['files']
+
+            with self._lock:
+                self.skipped_count += 1
+
+            for name in files:
+                file_path = os.path.join(dir_path, name)
+                try:
+                    fingerprint = get_file_fingerprint(os.stat(file_path))
+                except OSError:
+                    continue
+
+                self._on_file(file_path, fingerprint)
+        else:
+            subdirs = []
+            files = []
+
+            with os.scandir(dir_path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if not self.path_filter.is_child_excluded(entry.path, entry.name):
+                                subdirs.append(entry.name)
+                            continue
+
+                        if os.path.splitext(entry.name)[1].lower() not in IMAGE_EXTENSIONS:
+                            continue
+
+                        if self.path_filter.is_child_excluded(entry.path, entry.name):
+                            continue
+
+                        fingerprint = get_file_fingerprint(entry.stat())
+                    except OSError:
+                        continue
+
+                    files.append(entry.name)
+                    self._on_file(entry.path, fingerprint)
+
+            with self._lock:
+                self.listed_count += 1
+
+        with self._lock:
+            self.directories[dir_path] = {'mtime_ns': mtime_ns, 'subdirs': subdirs, 'files': files}
+
+        for name in subdirs:
+            self._submit(os.path.join(dir_path, name))
@@ -0,0 +1,310 @@
+import os
+import json
+import threading
+from pathlib import Path
+from typing import List, Optional, Tuple
+import numpy as np
+
+STORE_VERSION = 2
+ID_DTYPE = np.dtype('<i8')
+SCALE_DTYPE = np.dtype('<f4')
+# Storage precisions of the mapped matrix; LMDB always keeps the float32 originals, so
+# the store can be rebuilt in another precision at any time
+PRECISION_DTYPES = {
+    'float32': np.dtype('<f4'),
+    'float16': np.dtype('<f2'),
+    'int8': np.dtype('i1'),
+}
+DEFAULT_PRECISION = 'float32'
+# Face ids start at 1, a deleted face keeps its row with this id until compaction
+TOMBSTONE = 0
+COMPACT_RATIO = 0.1
+
+
+def quantize(embeddings: np.ndarray, precision: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Converts float32 rows to the storage precision, int8 rows get a scale each"""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if precision != 'int8':
+        return embeddings.astype(PRECISION_DTYPES[precision]), None
+
+    scales = np.abs(embeddings).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    values = np.clip(np.rint(embeddings / scales[:, None]), -127, 127).astype(PRECISION_DTYPES['int8'])
+    return values, scales.astype(SCALE_DTYPE)
+
+
+def dequantize(values: np.ndarray, scales: Optional[np.ndarray]) -> np.ndarray:
+    embeddings = values.astype(np.float32)
+    if scales is not None:
+        embeddings *= scales[:, None]
+    return embeddings
+
+
+def measure_precision(sample: np.ndarray, precision: str, threshold: float) -> dict:
+    """Compares pairwise cosine similarities of float32 rows with the same rows stored in
+    the given precision: error statistics and how many pairs cross the edge threshold"""
+    def pairwise(embeddings):
+        embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return (embeddings @ embeddings.T)[np.triu_indices(len(embeddings), k=1)]
+
+    exact = pairwise(np.asarray(sample, dtype=np.float32))
+    approx = pairwise(dequantize(*quantize(sample, precision)))
+    error = np.abs(approx - exact)
+
+    return {
+        'precision': precision,
+        'bytes_per_face': sample.shape[1] * PRECISION_DTYPES[precision].itemsize
+                          + (SCALE_DTYPE.itemsize if precision == 'int8' else 0),
+        'pairs': len(exact),
+        'mean_error': float(error.mean()) if len(error) else 0.0,
+        'p99_error': float(np.percentile(error, 99)) if len(error) else 0.0,
+        'max_error': float(error.max()) if len(error) else 0.0,
+        'threshold_flips': int(((exact >= threshold) != (approx >= threshold)).sum()),
+        'edges': int((exact >= threshold).sum())
+    }
+
+
+def format_precision_report(report: dict) -> str:
+    return (
+        f"Embedding precision {report['precision']} ({report['bytes_per_face']} bytes per face): "
+        f"similarity error mean {report['mean_error']:.4f}, 99th percentile {report['p99_error']:.4f}, "
+        f"max {report['max_error']:.4f} over {report['pairs']} pairs; "
+        f"{report['threshold_flips']} of {report['edges']} edges cross the threshold"
+    )
+
+
+class EmbeddingMatrix:
+    """Embedding rows as stored, float32, float16 or int8 with a scale per row.
+
+    values may also hold rows that are not part of the matrix, like deleted faces still
+    in the mapped file. rows then gives the stored row of each row of the matrix, so a
+    selection never copies the mapping.
+    """
+
+    def __init__(self, values: np.ndarray, scales: Optional[np.ndarray] = None, rows: Optional[np.ndarray] = None):
+        self.values = values
+        self.scales = scales
+        self.rows = rows
+
+    def __len__(self) -> int:
+        return len(self.values) if self.rows is None else len(self.rows)
+
+    @property
+    def dim(self) -> int:
+        return self.values.shape[1]
+
+    def select(self, mask: np.ndarray) -> 'EmbeddingMatrix':
+        rows = np.nonzero(mask)[0] if self.rows is None else self.rows[mask]
+        return EmbeddingMatrix(self.values, self.scales, rows)
+
+    def gather(self, rows) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """Stored values and scales of the given rows of the matrix"""
+        if self.rows is not None:
+            rows = self.rows[rows]
+        return self.values[rows], self.scales[rows] if self.scales is not None else None
+
+
+class EmbeddingStore:
+    """Append-only embedding matrix on disk, mapped into memory for bulk reads.
+
+    Rows live in a raw file in the configured precision, their face ids in a parallel
+    int64 file, and for int8 the row scales in a third one. A JSON header records the
+    precision, dimension and how many rows are committed, so a crash halfway through an
+    append leaves only an ignored tail. Deleting a face overwrites its id with a
+    tombstone; once tombstones pass COMPACT_RATIO of the rows, the live rows are copied
+    to files of a new generation. Mapped files are never rewritten in place, which keeps
+    existing views valid and lets Windows open the new files while old ones are mapped.
+
+    LMDB stays the source of truth, the store is checked against it and rebuilt from it
+    when they disagree.
+    """
+
+    def __init__(self, folder: str):
+        self.folder = Path(folder)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.header_path = self.folder / "store.json"
+        self._lock = threading.Lock()
+        self.header = self._read_header()
+        self._remove_stale_generations()
+
+    def _read_header(self) -> dict:
+        try:
+            with open(self.header_path, 'r') as f:
+                header = json.load(f)
+            if header.get('version') == STORE_VERSION:
+                return header
+        except (OSError, ValueError):
+            pass
+        return {
+            'version': STORE_VERSION, 'generation': 0, 'precision': DEFAULT_PRECISION,
+            'dim': 0, 'rows': 0, 'tombstones': 0, 'max_id': 0
+        }
+
+    def _write_header(self, header: dict):
+        temp_path = self.header_path.with_suffix('.tmp')
+        with open(temp_path, 'w') as f:
+            json.dump(header, f)
+        os.replace(temp_path, self.header_path)
+        self.header = header
+
+    def _paths(self, generation: int) -> Tuple[Path, Path, Path]:
+        return (
+            self.folder / f"embeddings.{generation}.bin",
+            self.folder / f"face_ids.{generation}.bin",
+            self.folder / f"scales.{generation}.bin"
+        )
+
+    def _remove_stale_generations(self):
+        current = set(self._paths(self.header['generation']))
+        for pattern in ('embeddings.*', 'face_ids.*', 'scales.*'):
+            for path in self.folder.glob(pattern):
+                if path in current:
+                    continue
+                try:
+                    path.unlink()
+                except OSError:
+                    # Still mapped by another process, removed on a later start
+                    pass
+
+    @property
+    def live_count(self) -> int:
+        return self.header['rows'] - self.header['tombstones']
+
+    @property
+    def max_face_id(self) -> int:
+        return self.header['max_id']
+
+    def append(self, face_ids: List[int], embeddings: np.ndarray):
+        if len(face_ids) == 0:
+            return
+
+        with self._lock:
+            header = dict(self.header)
+            if header['dim'] == 0:
+                header['dim'] = embeddings.shape[1]
+            elif header['dim'] != embeddings.shape[1]:
+                raise ValueError(f"Embedding size {embeddings.shape[1]} does not match the store ({header['dim']})")
+
+            values, scales = quantize(embeddings, header['precision'])
+            data_path, ids_path, scales_path = self._paths(header['generation'])
+            rows = header['rows']
+            self._write_at(data_path, rows * values[0].nbytes, values.tobytes())
+            self._write_at(ids_path, rows * ID_DTYPE.itemsize, np.asarray(face_ids, dtype=ID_DTYPE).tobytes())
+            if scales is not None:
+                self._write_at(scales_path, rows * SCALE_DTYPE.itemsize, scales.tobytes())
+
+            header['rows'] = rows + len(face_ids)
+            header['max_id'] = max(header['max_id'], int(max(face_ids)))
+            self._write_header(header)
+
+    @staticmethod
+    def _write_at(path: Path, offset: int, data: bytes):
+        mode = 'r+b' if path.exists() else 'wb'
+        with open(path, mode) as f:
+            f.seek(offset)
+            f.write(data)
+
+    def remove(self, face_ids: List[int]):
+        if len(face_ids) == 0 or self.header['rows'] == 0:
+            return
+
+        with self._lock:
+            header = dict(self.header)
+            _, ids_path, _ = self._paths(header['generation'])
+            ids = np.memmap(ids_path, dtype=ID_DTYPE, mode='r+', shape=(header['rows'],))
+            rows = np.nonzero(np.isin(ids, np.asarray(face_ids, dtype=ID_DTYPE)))[0]
+            if len(rows) == 0:
+                return
+            newest_removed = int(ids[rows].max()) == header['max_id']
+            ids[rows] = TOMBSTONE
+            ids.flush()
+            if newest_removed:
+                # Tombstones are 0, below every face id, so this is the newest live face
+                header['max_id'] = int(ids.max())
+            del ids
+
+            header['tombstones'] += len(rows)
+            self._write_header(header)
+
+    def _map(self, mode: str) -> Tuple[np.ndarray, EmbeddingMatrix]:
+        header = self.header
+        data_path, ids_path, scales_path = self._paths(header['generation'])
+        dtype = PRECISION_DTYPES[header['precision']]
+
+        values = np.memmap(data_path, dtype=dtype, mode=mode, shape=(header['rows'], header['dim']))
+        scales = None
+        if header['precision'] == 'int8':
+            scales = np.fromfile(scales_path, dtype=SCALE_DTYPE, count=header['rows'])
+        face_ids = np.fromfile(ids_path, dtype=ID_DTYPE, count=header['rows'])
+        return face_ids, EmbeddingMatrix(values, scales)
+
+    def load(self) -> Tuple[np.ndarray, EmbeddingMatrix]:
+        """Returns face ids and the live rows, mapped without a copy.
+
+        Rows of deleted faces stay in the mapping until compaction and are skipped through
+        the matrix's row index. The mapping is copy-on-write, so callers may scale it in
+        place without touching the file, while unmodified pages stay shared between processes.
+        """
+        with self._lock:
+            if self.header['tombstones'] > self.header['rows'] * COMPACT_RATIO:
+                self._compact()
+
+            header = self.header
+            if header['rows'] == 0:
+                dtype = PRECISION_DTYPES[header['precision']]
+                return np.empty(0, dtype=ID_DTYPE), EmbeddingMatrix(np.empty((0, header['dim']), dtype=dtype))
+
+            face_ids, embeddings = self._map('c')
+
+        if header['tombstones']:
+            live = face_ids != TOMBSTONE
+            return face_ids[live], embeddings.select(live)
+        return face_ids, embeddings
+
+    def rebuild(self, face_ids: np.ndarray, embeddings: np.ndarray, precision: str):
+        """Replaces the whole store with float32 rows converted to precision, used when it
+        no longer matches LMDB or the precision setting changed"""
+        with self._lock:
+            values, scales = quantize(embeddings, precision) if len(face_ids) else (embeddings, None)
+            self._write_generation(np.asarray(face_ids, dtype=ID_DTYPE), values, scales, precision)
+
+    def _compact(self):
+        face_ids, embeddings = self._map('r')
+        live = np.nonzero(face_ids != TOMBSTONE)[0]
+        values, scales = embeddings.gather(live)
+        self._write_generation(face_ids[live], values, scales, self.header['precision'])
+
+    def _write_generation(self, face_ids: np.ndarray, values: np.ndarray, scales: Optional[np.ndarray], precision: str):
+        old_paths = self._paths(self.header['generation'])
+        generation = self.header['generation'] + 1
+        data_path, ids_path, scales_path = self._paths(generation)
+
+        np.ascontiguousarray(values, dtype=PRECISION_DTYPES[precision]).tofile(data_path)
+        face_ids.tofile(ids_path)
+        if scales is not None:
+            np.asarray(scales, dtype=SCALE_DTYPE).tofile(scales_path)
+
+        self._write_header({
+            'version': STORE_VERSION,
+            'generation': generation,
+            'precision': precision,
+            'dim': values.shape[1] if values.ndim == 2 else 0,
+            'rows': len(face_ids),
+            'tombstones': 0,
+            'max_id': int(face_ids.max()) if len(face_ids) else 0
+        })
+
+        for path in old_paths:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+    def matches(self, entries: int, max_face_id: Optional[int], precision: str) -> bool:
+        """Whether the store is in the given precision and holds as many faces as LMDB,
+        up to the same newest face"""
+        return (
+            self.header['precision'] == precision
+            and self.live_count == entries
+            and self.max_face_id == (max_face_id or 0)
+        )
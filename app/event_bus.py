@@ -0,0 +1,74 @@
+import json
+import threading
+from collections import deque
+from typing import Callable, Optional
+
+
+class UIEventBus:
+    """Buffers status messages and progress for the webview and pushes them at a fixed rate.
+
+    Callers only append to a bounded ring buffer, so a scan thread never waits on the
+    JS bridge. A flush thread sends all buffered messages in one evaluate_js call per
+    frame; progress keeps only the latest value. When the buffer overflows, the oldest
+    messages are dropped and the UI is told how many were skipped.
+    """
+
+    def __init__(self, get_window: Callable, max_messages: int = 1000, frame_interval: float = 0.1):
+        self.get_window = get_window
+        self.frame_interval = frame_interval
+
+        self._messages = deque(maxlen=max_messages)
+        self._dropped = 0
+        self._progress: Optional[tuple] = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="UIEventBus")
+        self._thread.start()
+
+    def post_status(self, message: str):
+        with self._lock:
+            if len(self._messages) == self._messages.maxlen:
+                self._dropped += 1
+            self._messages.append(message)
+
+    def post_progress(self, current: int, total: int):
+        with self._lock:
+            self._progress = (current, total)
+
+    def flush(self):
+        """Sends everything buffered so far, also used before UI calls that must come after it"""
+        window = self.get_window()
+        if window is None:
+            return
+
+        # One flush at a time, so batches reach the UI in the order they were taken
+        with self._flush_lock:
+            with self._lock:
+                messages = list(self._messages)
+                self._messages.clear()
+                dropped = self._dropped
+                self._dropped = 0
+                progress = self._progress
+                self._progress = None
+
+            if dropped:
+                messages.insert(0, f"... {dropped} older messages skipped")
+
+            try:
+                if messages:
+                    window.evaluate_js(f'updateStatusMessages({json.dumps(messages)})')
+                if progress is not None:
+                    current, total = progress
+                    percent = (current / total) * 100 if total > 0 else 0
+                    window.evaluate_js(f'updateProgress({current}, {total}, {percent})')
+            except Exception as e:
+                print(f"Error sending status to UI: {e}")
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join(timeout=1)
+
+    def _run(self):
+        while not self._stop_event.wait(self.frame_interval):
+            self.flush()
@@ -0,0 +1,512 @@
+import os
+import time
+import random
+import hashlib
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import Callable, List, Optional, Tuple
+import numpy as np
+import cv2
+import onnxruntime
+import pillow_heif
+from PIL import Image, ImageOps, ExifTags
+from insightface.app import FaceAnalysis
+from insightface.utils import face_align
+
+from utils import get_insightface_root
+from resource_governor import lower_process_priority
+
+PROVIDERS = ['CPUExecutionProvider']
+MODEL_PACKS = ('buffalo_l', 'buffalo_s')
+DEFAULT_MODEL_PACK = 'buffalo_l'
+# Only bbox and embedding are used, so the landmark and gender/age models are never loaded
+ALLOWED_MODULES = ['detection', 'recognition']
+DET_SIZE = (640, 640)
+
+# Photos are decoded no larger than needed: the detector only sees 640px, but face crops
+# for recognition are cut from the decoded image, so keep twice that on the long side
+DECODE_MAX_SIDE = DET_SIZE[0] * 2
+
+# An embedded preview is used when it covers the detector input; a face narrower than this
+# in the preview is too blurry to embed well, so that photo is decoded again in full
+PREVIEW_MIN_SIDE = DET_SIZE[0]
+PREVIEW_MIN_FACE = 80
+
+# Cascade mode runs the detector at a quarter of the pixels first, with a lower score
+# threshold than the regular 0.5, and skips the photo when nothing at all comes up.
+# A small random sample of skipped photos is still detected in full to measure recall
+CASCADE_DET_SIZE = (320, 320)
+CASCADE_SCORE = 0.3
+CASCADE_AUDIT_RATE = 0.02
+
+# Panoramas, and large photos whose pass over the whole image finds faces close to the
+# smallest the detector sees, are detected again in overlapping tiles at full resolution,
+# because downscaling them to the detector size leaves distant faces a few pixels wide.
+# Other photos, including most 48 MP phone shots, keep the reduced decode
+TILE_SIZE = DET_SIZE[0] * 2
+TILE_OVERLAP = 256
+TILE_MIN_ASPECT = 2.5
+TILE_FACE_SIDE = 16
+TILE_THREADS = 2
+
+# Aligned face crops from many photos are embedded together, one ONNX run per batch
+REC_BATCH_SIZE = 64
+
+# Length of the MD5 hex digests stored before file hashes switched to BLAKE2b
+LEGACY_HASH_LENGTH = 32
+
+# Seconds to wait for a worker process to load the model, which may include downloading
+# the pack, and for one call into a worker; a worker that crashed never answers
+MODEL_LOAD_TIMEOUT = 600
+WORKER_CALL_TIMEOUT = 600
+
+_ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+
+def resolve_worker_count(configured: int) -> int:
+    """0 means auto: one process per 4 cores, capped to keep model RAM in check"""
+    if configured and configured > 0:
+        return int(configured)
+    cpu_count = os.cpu_count() or 1
+    return max(1, min(cpu_count // 4, 6))
+
+
+def resolve_onnx_threads(num_workers: int) -> int:
+    cpu_count = os.cpu_count() or 1
+    return max(1, cpu_count // max(1, num_workers))
+
+
+def create_face_app(model_root: str, onnx_threads: int = 0, model_pack: str = DEFAULT_MODEL_PACK) -> FaceAnalysis:
+    face_app = FaceAnalysis(
+        name=model_pack,
+        root=model_root,
+        providers=PROVIDERS,
+        allowed_modules=ALLOWED_MODULES
+    )
+
+    if onnx_threads > 0:
+        session_options = onnxruntime.SessionOptions()
+        session_options.intra_op_num_threads = onnx_threads
+        session_options.inter_op_num_threads = 1
+        session_options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+
+        # FaceAnalysis does not forward session options, so rebuild each session with them
+        for model in face_app.models.values():
+            model.session = onnxruntime.InferenceSession(
+                model.model_file,
+                sess_options=session_options,
+                providers=PROVIDERS
+            )
+
+    face_app.prepare(ctx_id=-1, det_size=DET_SIZE)
+    return face_app
+
+
+def read_file(file_path: str) -> bytes:
+    with open(file_path, 'rb') as f:
+        return f.read()
+
+
+def hash_bytes(data: bytes) -> str:
+    # BLAKE2b outruns MD5 on 64-bit CPUs; the 20 byte digest keeps these hashes
+    # distinguishable from the 32 character MD5 values written by older versions
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+
+def legacy_hash_bytes(data: bytes) -> str:
+    """The MD5 hash older versions stored, matched while such rows remain"""
+    return hashlib.md5(data).hexdigest()
+
+
+def is_legacy_hash(file_hash: Optional[str]) -> bool:
+    return file_hash is not None and len(file_hash) == LEGACY_HASH_LENGTH
+
+
+def decode_image(data: bytes, max_side: int = DECODE_MAX_SIDE) -> Tuple[np.ndarray, float]:
+    """Decodes to BGR at reduced size, returns the image and its scale against the original.
+
+    JPEGs are downscaled in the DCT domain through draft(), so a 48 MP photo is never
+    decoded at full size. Other formats are decoded in full and then reduced by an
+    integer factor before conversion. A max_side of 0 decodes at full resolution, as
+    do photos that need tiled detection.
+    """
+    pil_image = Image.open(BytesIO(data))
+    original_side = max(pil_image.size)
+
+    # Tiled detection needs every pixel, so these are decoded at full size
+    if needs_tiling(*pil_image.size):
+        max_side = 0
+
+    if max_side and original_side > max_side:
+        ratio = max_side / original_side
+        requested = (max(1, int(pil_image.size[0] * ratio)), max(1, int(pil_image.size[1] * ratio)))
+        # draft() keeps the image at least the requested size and is a no-op for non-JPEGs
+        pil_image.draft('RGB', requested)
+
+        # reduce() averages raw pixel values, which is wrong for palette images
+        factor = max(pil_image.size) // max_side
+        if factor >= 2:
+            pil_image = pil_image.convert('RGB').reduce(factor)
+
+    scale = max(pil_image.size) / original_side
+
+    pil_image = ImageOps.exif_transpose(pil_image)
+    return _to_bgr(pil_image), scale
+
+
+def _to_bgr(pil_image: Image.Image) -> np.ndarray:
+    image_rgb = np.array(pil_image.convert('RGB'))
+    return cv2.cvtColor(image_rgb, cv2.COLOR_RGB2BGR)
+
+
+def _smallest_adequate(images: List[Image.Image], min_side: int) -> Optional[Image.Image]:
+    adequate = [image for image in images if max(image.size) >= min_side]
+    return min(adequate, key=lambda image: max(image.size)) if adequate else None
+
+
+def _heif_preview(data: bytes, min_side: int) -> Optional[Image.Image]:
+    # info['thumbnails'] lists the long side of each thumbnail of the primary image;
+    # libheif applies the primary image's rotation to its thumbnails as well
+    heif_file = pillow_heif.open_heif(BytesIO(data))
+    primary = heif_file[heif_file.primary_index]
+    sides = primary.info.get('thumbnails', [])
+    adequate = [(side, index) for index, side in enumerate(sides) if side >= min_side]
+    if not adequate:
+        return None
+    _, index = min(adequate)
+    return primary.get_thumbnail(index).to_pillow()
+
+
+def _jpeg_preview(pil_image: Image.Image, min_side: int) -> Optional[Image.Image]:
+    candidates = []
+
+    # MPF previews, the 1080p or VGA copies many cameras append after the main image
+    for frame in range(1, getattr(pil_image, 'n_frames', 1)):
+        pil_image.seek(frame)
+        if max(pil_image.size) >= min_side:
+            candidates.append(pil_image.copy())
+    if getattr(pil_image, 'n_frames', 1) > 1:
+        pil_image.seek(0)
+
+    # The EXIF IFD1 thumbnail, its offset is relative to the TIFF header after 'Exif\0\0'
+    raw_exif = pil_image.info.get('exif')
+    if raw_exif:
+        ifd1 = pil_image.getexif().get_ifd(ExifTags.IFD.IFD1)
+        offset, length = ifd1.get(0x0201), ifd1.get(0x0202)
+        if offset and length:
+            thumbnail = Image.open(BytesIO(raw_exif[6 + offset:6 + offset + length]))
+            if max(thumbnail.size) >= min_side:
+                thumbnail.load()
+                candidates.append(thumbnail)
+
+    preview = _smallest_adequate(candidates, min_side)
+    if preview is None:
+        return None
+
+    # Previews are stored like the main image, unrotated, so its orientation applies
+    orientation = pil_image.getexif().get(0x0112, 1)
+    if orientation in _ORIENTATION_TRANSPOSE:
+        preview = preview.transpose(_ORIENTATION_TRANSPOSE[orientation])
+    return preview
+
+
+def extract_preview(data: bytes, min_side: int = PREVIEW_MIN_SIDE) -> Optional[Tuple[np.ndarray, float]]:
+    """Returns a BGR preview embedded in the file and its scale, or None if none is adequate.
+
+    HEIC thumbnails and JPEG MPF or EXIF previews decode in a fraction of the time of
+    the main image. Previews with a different aspect ratio (letterboxed) are ignored,
+    so boxes found in them map straight back onto the original.
+    """
+    try:
+        pil_image = Image.open(BytesIO(data))
+        if pil_image.format in ('HEIF', 'HEIC', 'AVIF'):
+            preview = _heif_preview(data, min_side)
+            original_size = pil_image.size
+        elif pil_image.format in ('JPEG', 'MPO'):
+            original_size = pil_image.size
+            orientation = pil_image.getexif().get(0x0112, 1)
+            preview = _jpeg_preview(pil_image, min_side)
+            if orientation in (5, 6, 7, 8):
+                original_size = original_size[::-1]
+        else:
+            return None
+    except (OSError, ValueError, RuntimeError):
+        # A damaged file or preview, the main image is decoded instead
+        return None
+
+    if preview is None or needs_tiling(*original_size):
+        return None
+
+    original_ratio = original_size[0] / original_size[1]
+    preview_ratio = preview.size[0] / preview.size[1]
+    if abs(preview_ratio - original_ratio) > 0.01 * original_ratio:
+        return None
+
+    return _to_bgr(preview), max(preview.size) / max(original_size)
+
+
+def needs_full_decode(faces: List[dict], scale: float) -> bool:
+    return any(
+        min(face['bbox'][2] - face['bbox'][0], face['bbox'][3] - face['bbox'][1]) * scale < PREVIEW_MIN_FACE
+        for face in faces
+    )
+
+
+def needs_tiling(width: int, height: int) -> bool:
+    """Panoramas are tiled from the start, decoded at full size"""
+    long_side, short_side = max(width, height), min(width, height)
+    if long_side < TILE_SIZE * 2:
+        return False
+    return long_side / max(1, short_side) >= TILE_MIN_ASPECT
+
+
+def needs_tiled_pass(faces: List[dict], image: np.ndarray, scale: float) -> bool:
+    """Whether a large photo detected as a whole found a face within TILE_FACE_SIDE pixels
+    of the detector input; a group shot like that likely has smaller faces it missed"""
+    original_side = max(image.shape[:2]) / scale
+    if original_side < TILE_SIZE * 2 or needs_tiling(image.shape[1], image.shape[0]):
+        return False
+    detector_ratio = DET_SIZE[0] / original_side
+    return any(
+        min(face['bbox'][2] - face['bbox'][0], face['bbox'][3] - face['bbox'][1]) * detector_ratio < TILE_FACE_SIDE
+        for face in faces
+    )
+
+
+def _tile_origins(length: int) -> List[int]:
+    if length <= TILE_SIZE:
+        return [0]
+    step = TILE_SIZE - TILE_OVERLAP
+    origins = list(range(0, length - TILE_SIZE, step))
+    origins.append(length - TILE_SIZE)
+    return origins
+
+
+def _detect_tile(det_model, image: np.ndarray, x0: int, y0: int) -> Tuple[np.ndarray, np.ndarray]:
+    height, width = image.shape[:2]
+    x1, y1 = min(x0 + TILE_SIZE, width), min(y0 + TILE_SIZE, height)
+    bboxes, kpss = det_model.detect(image[y0:y1, x0:x1], max_num=0, metric='default')
+    if len(bboxes) == 0:
+        return bboxes, kpss
+
+    bboxes[:, [0, 2]] += x0
+    bboxes[:, [1, 3]] += y0
+    kpss[:, :, 0] += x0
+    kpss[:, :, 1] += y0
+
+    # A face cut by an inner tile edge lies whole in the overlap of the neighbouring tile,
+    # or is big enough for the pass over the whole image, so its partial box is dropped
+    margin = 2
+    keep = np.ones(len(bboxes), dtype=bool)
+    if x0 > 0:
+        keep &= bboxes[:, 0] > x0 + margin
+    if y0 > 0:
+        keep &= bboxes[:, 1] > y0 + margin
+    if x1 < width:
+        keep &= bboxes[:, 2] < x1 - margin
+    if y1 < height:
+        keep &= bboxes[:, 3] < y1 - margin
+    return bboxes[keep], kpss[keep]
+
+
+def _detect_tiled(det_model, image: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Whole image pass plus overlapping tiles, merged with the detector's own NMS"""
+    height, width = image.shape[:2]
+    origins = [(x0, y0) for y0 in _tile_origins(height) for x0 in _tile_origins(width)]
+
+    results = [det_model.detect(image, max_num=0, metric='default')]
+    with ThreadPoolExecutor(max_workers=min(TILE_THREADS, len(origins))) as executor:
+        results.extend(executor.map(lambda origin: _detect_tile(det_model, image, *origin), origins))
+
+    results = [(bboxes, kpss) for bboxes, kpss in results if len(bboxes) > 0]
+    if not results:
+        return np.zeros((0, 5), dtype=np.float32), np.zeros((0, 5, 2), dtype=np.float32)
+
+    bboxes = np.vstack([bboxes for bboxes, _ in results])
+    kpss = np.vstack([kpss for _, kpss in results])
+    keep = det_model.nms(bboxes)
+    return bboxes[keep], kpss[keep]
+
+
+def detect_faces(face_app: FaceAnalysis, image: np.ndarray, scale: float = 1.0, tiled: bool = False) -> List[dict]:
+    """Finds faces and cuts their aligned crops, embed_faces() turns the crops into embeddings.
+
+    Bounding boxes are returned in the coordinates of the original, full size photo.
+    """
+    rec_model = face_app.models['recognition']
+    if tiled or needs_tiling(image.shape[1], image.shape[0]):
+        bboxes, kpss = _detect_tiled(face_app.det_model, image)
+    else:
+        bboxes, kpss = face_app.det_model.detect(image, max_num=0, metric='default')
+
+    face_data = []
+    for bbox, kps in zip(bboxes, kpss):
+        crop = face_align.norm_crop(image, landmark=kps, image_size=rec_model.input_size[0])
+        face_data.append({'bbox': (bbox[:4] / scale).tolist(), 'crop': crop})
+    return face_data
+
+
+def embed_crops(face_app: FaceAnalysis, crops: List[np.ndarray]) -> np.ndarray:
+    """Normalized embeddings of aligned face crops, run through the model REC_BATCH_SIZE at a time"""
+    rec_model = face_app.models['recognition']
+    embeddings = [
+        rec_model.get_feat(crops[start:start + REC_BATCH_SIZE])
+        for start in range(0, len(crops), REC_BATCH_SIZE)
+    ]
+    embeddings = np.concatenate(embeddings).astype(np.float32)
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+def embed_faces(faces: List[dict], embed: Callable[[List[np.ndarray]], np.ndarray]):
+    """Replaces the crop of each face with its embedding, computed by embed in one call"""
+    pending = [face for face in faces if 'crop' in face]
+    if not pending:
+        return
+
+    embeddings = embed([face['crop'] for face in pending])
+    for face, embedding in zip(pending, embeddings):
+        del face['crop']
+        face['embedding'] = embedding
+
+
+def prefilter_has_faces(face_app: FaceAnalysis, image: np.ndarray) -> bool:
+    det_model = face_app.det_model
+    threshold = det_model.det_thresh
+    det_model.det_thresh = CASCADE_SCORE
+    try:
+        bboxes, _ = det_model.detect(image, input_size=CASCADE_DET_SIZE)
+    finally:
+        det_model.det_thresh = threshold
+    return len(bboxes) > 0
+
+
+def analyze_image(face_app: FaceAnalysis, image: np.ndarray, scale: float, data: Optional[bytes] = None,
+                  cascade: bool = False, preview: bool = False) -> Tuple[List[dict], dict]:
+    """Detects the faces of a decoded photo, returns them with crops and cascade stats.
+
+    data is the original file. When the image is an embedded preview, the file is decoded
+    if a face turns out too small in the preview; when the faces found are close to the
+    detector's limit, it is decoded at full size for a tiled pass.
+    """
+    stats = {'skipped': False, 'audited': False, 'prefilter_ms': 0.0, 'full_ms': 0.0}
+
+    # The prefilter works on a 320px copy, which cannot rule out faces in a tiled photo
+    if cascade and not needs_tiling(image.shape[1], image.shape[0]):
+        start = time.perf_counter()
+        has_faces = prefilter_has_faces(face_app, image)
+        stats['prefilter_ms'] = (time.perf_counter() - start) * 1000
+        if not has_faces:
+            stats['skipped'] = True
+            if random.random() >= CASCADE_AUDIT_RATE:
+                return [], stats
+            stats['audited'] = True
+
+    start = time.perf_counter()
+    faces = detect_faces(face_app, image, scale)
+    if data is not None and preview and needs_full_decode(faces, scale):
+        image, scale = decode_image(data)
+        faces = detect_faces(face_app, image, scale)
+    if data is not None and needs_tiled_pass(faces, image, scale):
+        image, scale = decode_image(data, max_side=0)
+        faces = detect_faces(face_app, image, scale, tiled=True)
+    stats['full_ms'] = (time.perf_counter() - start) * 1000
+
+    # Faces found by an audit are kept, the audit only measures what the prefilter missed
+    return faces, stats
+
+
+_worker_face_app = None
+_worker_error = None
+
+
+def _init_pool_worker(model_root: str, onnx_threads: int, model_pack: str):
+    global _worker_face_app, _worker_error
+    lower_process_priority()
+    # A worker dying here is replaced by the pool again and again while calls wait for
+    # good, so the failure is kept and raised by every call instead
+    try:
+        _worker_face_app = create_face_app(model_root, onnx_threads, model_pack)
+    except Exception as e:
+        _worker_error = f"{type(e).__name__}: {e}"
+
+
+def _check_worker():
+    if _worker_error is not None:
+        raise RuntimeError(_worker_error)
+
+
+def _embed_in_worker(crops: List[np.ndarray]) -> np.ndarray:
+    _check_worker()
+    return embed_crops(_worker_face_app, crops)
+
+
+def _analyze_in_worker(data: bytes, cascade: bool) -> dict:
+    _check_worker()
+    preview = extract_preview(data)
+    try:
+        image, scale = preview if preview is not None else decode_image(data)
+    except Exception as e:
+        return {'status': 'error', 'faces': [], 'error': f"Cannot read image: {e}"}
+
+    try:
+        faces, stats = analyze_image(_worker_face_app, image, scale, data, cascade, preview is not None)
+        return {'status': 'completed', 'faces': faces, 'error': None, 'cascade': stats}
+    except Exception as e:
+        return {'status': 'error', 'faces': [], 'error': str(e)}
+
+
+class DetectionPool:
+    """Pool of worker processes, each holding its own InsightFace session.
+
+    Creating the pool waits until a worker has loaded the model and raises if it could
+    not, so a scan is not handed a pool whose every call fails.
+    """
+
+    def __init__(self, num_workers: int, onnx_threads: int = 0, model_pack: str = DEFAULT_MODEL_PACK):
+        self.num_workers = num_workers
+        self.onnx_threads = onnx_threads or resolve_onnx_threads(num_workers)
+
+        context = multiprocessing.get_context('spawn')
+        self._pool = context.Pool(
+            processes=num_workers,
+            initializer=_init_pool_worker,
+            initargs=(get_insightface_root(), self.onnx_threads, model_pack)
+        )
+
+        try:
+            # Every worker loads the same files, so one worker shows whether all of them can
+            self._pool.apply_async(_check_worker).get(MODEL_LOAD_TIMEOUT)
+        except multiprocessing.TimeoutError:
+            self._pool.terminate()
+            raise RuntimeError(f"Detection processes did not load the model within {MODEL_LOAD_TIMEOUT}s")
+        except Exception:
+            self._pool.terminate()
+            raise
+
+    def analyze(self, data: bytes, cascade: bool = False) -> dict:
+        """Blocks the calling thread until a worker process has decoded and detected the photo.
+
+        Faces come back with their aligned crops, which are embedded in batches by embed().
+        """
+        return self._pool.apply_async(_analyze_in_worker, (data, cascade)).get(WORKER_CALL_TIMEOUT)
+
+    def embed(self, crops: List[np.ndarray]) -> np.ndarray:
+        """Embeds the face crops of many photos in one worker process"""
+        return self._pool.apply_async(_embed_in_worker, (crops,)).get(WORKER_CALL_TIMEOUT)
+
+    def close(self):
+        try:
+            self._pool.close()
+            self._pool.join()
+        except Exception as e:
+            print(f"Error closing detection pool: {e}")
+            self._pool.terminate()
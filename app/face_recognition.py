@@ -1,4 +1,5 @@
 import argparse
+import multiprocessing
 import torch
 import webview
 
@@ -58,4 +59,5 @@ def main():
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     main()
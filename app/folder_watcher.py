@@ -0,0 +1,136 @@
+import os
+import threading
+import time
+from typing import List
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+    WATCHDOG_AVAILABLE = True
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+    WATCHDOG_AVAILABLE = False
+
+from discovery import IMAGE_EXTENSIONS
+
+
+class _ChangeCollector(FileSystemEventHandler):
+    def __init__(self, watcher: 'FolderWatcher'):
+        super().__init__()
+        self.watcher = watcher
+
+    def on_created(self, event):
+        self.watcher.record_updated(event.src_path, event.is_directory)
+
+    def on_modified(self, event):
+        # A folder is reported as modified whenever one of its entries changes
+        if not event.is_directory:
+            self.watcher.record_updated(event.src_path, False)
+
+    def on_deleted(self, event):
+        self.watcher.record_removed(event.src_path)
+
+    def on_moved(self, event):
+        self.watcher.record_removed(event.src_path)
+        self.watcher.record_updated(event.dest_path, event.is_directory)
+
+
+class FolderWatcher:
+    """Feeds changes in the include folders to incremental scans while the app is running.
+
+    Uses native filesystem notifications through watchdog when it is installed. Without
+    it, the regular scan is run every poll_interval seconds, which with the directory
+    index only lists folders whose mtime changed. Events are held until the folders have
+    been quiet for settle_seconds, so copying an album in becomes one scan.
+    """
+
+    def __init__(self, api, include_folders: List[str], settle_seconds: float = 3.0, poll_interval: int = 300):
+        self.api = api
+        self.include_folders = include_folders
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+
+        self._observer = None
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._updated = set()
+        self._removed = set()
+        self._last_event_time = 0.0
+
+    @property
+    def mode(self) -> str:
+        return 'native' if self._observer is not None else 'polling'
+
+    def start(self):
+        if WATCHDOG_AVAILABLE:
+            try:
+                observer = Observer()
+                handler = _ChangeCollector(self)
+                for folder in self.include_folders:
+                    if os.path.isdir(folder):
+                        observer.schedule(handler, folder, recursive=True)
+                observer.start()
+                self._observer = observer
+            except Exception as e:
+                print(f"Filesystem notifications unavailable, falling back to polling: {e}")
+                self._observer = None
+
+        self._thread = threading.Thread(target=self._run, daemon=True, name="FolderWatcher")
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+        if self._observer is not None:
+            try:
+                self._observer.stop()
+                self._observer.join(timeout=2)
+            except Exception as e:
+                print(f"Error stopping folder watcher: {e}")
+            self._observer = None
+
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._thread = None
+
+    def record_updated(self, path: str, is_directory: bool):
+        if not is_directory and os.path.splitext(path)[1].lower() not in IMAGE_EXTENSIONS:
+            return
+
+        with self._lock:
+            self._updated.add(path)
+            self._removed.discard(path)
+            self._last_event_time = time.monotonic()
+
+    def record_removed(self, path: str):
+        with self._lock:
+            self._removed.add(path)
+            self._updated.discard(path)
+            self._last_event_time = time.monotonic()
+
+    def _run(self):
+        last_poll = time.monotonic()
+
+        while not self._stop_event.wait(1.0):
+            if self._observer is None:
+                if time.monotonic() - last_poll >= self.poll_interval:
+                    if self.api.start_scanning(background=True):
+                        last_poll = time.monotonic()
+                continue
+
+            with self._lock:
+                if not self._updated and not self._removed:
+                    continue
+                if time.monotonic() - self._last_event_time < self.settle_seconds:
+                    continue
+                changes = {'updated': self._updated, 'removed': self._removed}
+                self._updated = set()
+                self._removed = set()
+
+            # A scan or clustering already running keeps the changes queued for the next tick
+            if not self.api.start_scanning(changes=changes, background=True):
+                with self._lock:
+                    self._updated |= changes['updated'] - self._removed
+                    self._removed |= changes['removed'] - self._updated
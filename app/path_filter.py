@@ -0,0 +1,92 @@
+import os
+import re
+import fnmatch
+from typing import List, Optional
+
+
+def _split_path(path: str) -> List[str]:
+    normalized = os.path.normcase(os.path.normpath(path))
+    return [part for part in normalized.split(os.sep) if part]
+
+
+class _PrefixTrie:
+    """Folder prefixes keyed by path component, so a lookup costs one step per component"""
+
+    def __init__(self, paths: List[str]):
+        self.root = {}
+        self.empty = True
+        for path in paths:
+            node = self.root
+            for part in _split_path(path):
+                node = node.setdefault(part, {})
+            node[None] = True
+            self.empty = False
+
+    def contains_prefix_of(self, parts: List[str]) -> bool:
+        node = self.root
+        for part in parts:
+            node = node.get(part)
+            if node is None:
+                return False
+            if None in node:
+                return True
+        return False
+
+
+class PathFilter:
+    """Include, exclude and wildcard rules compiled once per scan.
+
+    Folder rules match on whole path components, so excluding C:\\Photos no longer
+    also excludes C:\\Photos2. Relative wildcards are fnmatch patterns tested against
+    each component through one combined regex; absolute ones act as excluded folders.
+    """
+
+    def __init__(self, include_folders: List[str], exclude_folders: List[str], wildcard_text: str):
+        wildcards = [w.strip() for w in (wildcard_text or '').split(',') if w.strip()]
+
+        absolute_wildcards = [w for w in wildcards if os.path.isabs(os.path.normpath(w))]
+        relative_wildcards = [w for w in wildcards if not os.path.isabs(os.path.normpath(w))]
+
+        self._includes = _PrefixTrie(include_folders)
+        self._excludes = _PrefixTrie(list(exclude_folders) + absolute_wildcards)
+        self._exclude_paths = {os.sep.join(_split_path(p)) for p in list(exclude_folders) + absolute_wildcards}
+
+        self._wildcard_regex: Optional[re.Pattern] = None
+        if relative_wildcards:
+            pattern = '|'.join(f'(?:{fnmatch.translate(os.path.normcase(w))})' for w in relative_wildcards)
+            self._wildcard_regex = re.compile(pattern)
+
+    def _name_matches_wildcard(self, name: str) -> bool:
+        return self._wildcard_regex is not None and self._wildcard_regex.match(os.path.normcase(name)) is not None
+
+    def is_excluded(self, path: str) -> bool:
+        """Full check of one path against every rule"""
+        if self._includes.empty:
+            return False
+
+        parts = _split_path(path)
+
+        if not self._includes.contains_prefix_of(parts):
+            return True
+
+        if self._excludes.contains_prefix_of(parts):
+            return True
+
+        if self._wildcard_regex is not None:
+            return any(self._name_matches_wildcard(part) for part in parts)
+
+        return False
+
+    def is_child_excluded(self, path: str, name: str) -> bool:
+        """Check for an entry whose parent folder already passed is_excluded.
+
+        Only the new component can change the outcome, so a directory walk prunes and
+        filters with one set lookup and one regex match per entry.
+        """
+        if self._includes.empty:
+            return False
+
+        if self._name_matches_wildcard(name):
+            return True
+
+        return bool(self._exclude_paths) and os.sep.join(_split_path(path)) in self._exclude_paths
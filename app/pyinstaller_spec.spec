@@ -14,6 +14,7 @@ a = Analysis(
         ('ui_js_script.js', '.'),
         ('icon.ico', '.'),
         ('C:/Users/Astha/.insightface/models/buffalo_l', 'models/buffalo_l'),
+        ('C:/Users/Astha/.insightface/models/buffalo_s', 'models/buffalo_s'),
     ] + collect_data_files('insightface'),
     hiddenimports=[
         'PIL._tkinter_finder',
@@ -0,0 +1,321 @@
+import os
+import sys
+import time
+import threading
+import multiprocessing
+from contextlib import contextmanager
+
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    psutil = None
+    PSUTIL_AVAILABLE = False
+
+IDLE_LOAD_PERCENT = 20
+SAMPLE_INTERVAL = 1.0
+PAUSE_STEPS = [0.0, 0.1, 0.25, 0.5, 1.0, 2.0]
+THREAD_PRIORITY_BELOW_NORMAL = -1
+
+
+def lower_process_priority():
+    """Drops CPU and disk priority of the calling process, used by the detection workers"""
+    try:
+        if PSUTIL_AVAILABLE:
+            process = psutil.Process()
+            if sys.platform == 'win32':
+                process.nice(psutil.BELOW_NORMAL_PRIORITY_CLASS)
+                process.ionice(psutil.IOPRIO_LOW)
+            else:
+                process.nice(10)
+                if hasattr(process, 'ionice'):
+                    process.ionice(psutil.IOPRIO_CLASS_IDLE)
+        elif hasattr(os, 'nice'):
+            os.nice(10)
+    except Exception as e:
+        print(f"Could not lower worker priority: {e}")
+
+
+def lower_thread_priority():
+    """Drops CPU priority of the calling thread only, for detection running inside the app
+    process, where lowering the whole process would slow the window down as well"""
+    try:
+        if sys.platform == 'win32':
+            import ctypes
+            kernel32 = ctypes.windll.kernel32
+            kernel32.SetThreadPriority(kernel32.GetCurrentThread(), THREAD_PRIORITY_BELOW_NORMAL)
+        elif sys.platform.startswith('linux'):
+            # Linux keeps a nice value per thread, addressed by its native id
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+    except Exception as e:
+        print(f"Could not lower scan thread priority: {e}")
+
+
+def _proc_cpu_seconds(pid: int) -> float:
+    """CPU time of a process from /proc, for measuring worker processes without psutil"""
+    with open(f"/proc/{pid}/stat", 'r') as f:
+        # The command name may contain spaces, the fields after it are fixed
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+class _LoadSampler:
+    """System and own CPU and disk use in percent of the whole machine"""
+
+    def __init__(self):
+        self.cpu_count = os.cpu_count() or 1
+        self._processes = {}
+        self._last_time = time.monotonic()
+        self._last_cpu = time.process_time()
+        self._child_cpu = {}
+        self._io_bytes = {}
+        self._last_disk = None
+
+        if PSUTIL_AVAILABLE:
+            psutil.cpu_percent(interval=None)
+            self._own = psutil.Process()
+            self._own.cpu_percent(interval=None)
+            self._last_disk = self._read_disk()
+            self._own_io_bytes()
+
+    def sample(self):
+        """Returns (system_percent, own_percent); system is None when it cannot be measured,
+        own is None when detection worker processes run that cannot be measured"""
+        if PSUTIL_AVAILABLE:
+            system = psutil.cpu_percent(interval=None)
+            own = self._own.cpu_percent(interval=None)
+
+            # Detection worker processes count as our load too. Process objects are kept
+            # between samples because cpu_percent measures since the previous call
+            try:
+                children = self._own.children(recursive=True)
+            except psutil.Error:
+                children = []
+            alive = set()
+            for child in children:
+                alive.add(child.pid)
+                process = self._processes.get(child.pid)
+                if process is None:
+                    self._processes[child.pid] = child
+                    try:
+                        child.cpu_percent(interval=None)
+                    except psutil.Error:
+                        pass
+                    continue
+                try:
+                    own += process.cpu_percent(interval=None)
+                except psutil.Error:
+                    pass
+            for pid in list(self._processes):
+                if pid not in alive:
+                    del self._processes[pid]
+
+            return system, own / self.cpu_count
+
+        now = time.monotonic()
+        cpu = time.process_time()
+        elapsed = max(now - self._last_time, 1e-6)
+        own_seconds = cpu - self._last_cpu
+        self._last_time, self._last_cpu = now, cpu
+
+        children = multiprocessing.active_children()
+        if children and not os.path.isdir('/proc'):
+            return None, None
+
+        child_cpu = {}
+        for child in children:
+            try:
+                child_cpu[child.pid] = _proc_cpu_seconds(child.pid)
+            except (OSError, ValueError, IndexError):
+                continue
+            own_seconds += child_cpu[child.pid] - self._child_cpu.get(child.pid, child_cpu[child.pid])
+        self._child_cpu = child_cpu
+        own = own_seconds / elapsed * 100 / self.cpu_count
+
+        if hasattr(os, 'getloadavg'):
+            system = min(100.0, os.getloadavg()[0] / self.cpu_count * 100)
+            return max(system, own), own
+
+        return None, own
+
+    def _read_disk(self):
+        """(time, busy ms, bytes moved) of all disks, None when psutil cannot tell"""
+        try:
+            disk = psutil.disk_io_counters(perdisk=False)
+        except Exception:
+            disk = None
+        if disk is None:
+            return None
+        busy_ms = getattr(disk, 'busy_time', disk.read_time + disk.write_time)
+        return time.monotonic(), busy_ms, disk.read_bytes + disk.write_bytes
+
+    def _own_io_bytes(self) -> int:
+        """Bytes read and written by us and the worker processes since the previous call"""
+        moved = 0
+        io_bytes = {}
+        for process in [self._own] + list(self._processes.values()):
+            try:
+                io = process.io_counters()
+            except (psutil.Error, AttributeError):
+                continue
+            io_bytes[process.pid] = io.read_bytes + io.write_bytes
+            moved += io_bytes[process.pid] - self._io_bytes.get(process.pid, io_bytes[process.pid])
+        self._io_bytes = io_bytes
+        return moved
+
+    def sample_disk(self):
+        """Returns (other_percent, own_percent) of the time the disks were busy since the
+        previous sample, split by our share of the bytes moved; (None, None) without psutil"""
+        if self._last_disk is None:
+            return None, None
+
+        current = self._read_disk()
+        if current is None:
+            return None, None
+        last, self._last_disk = self._last_disk, current
+        own_bytes = self._own_io_bytes()
+
+        elapsed_ms = max((current[0] - last[0]) * 1000, 1e-3)
+        busy = min(100.0, max(0, current[1] - last[1]) / elapsed_ms * 100)
+        disk_bytes = current[2] - last[2]
+        # Reads served from the file cache count for us but never reach the disk
+        share = min(1.0, max(0, own_bytes) / disk_bytes) if disk_bytes > 0 else 0.0
+        return busy * (1 - share), busy * share
+
+
+class ResourceGovernor:
+    """Paces the detection stage from measured load instead of a fixed sleep.
+
+    While the window is in front, or dynamic resources are off, scanning runs at full
+    speed. In the background the load of everything else on the machine is sampled
+    once a second: an idle machine gets full speed, a busy one gets at most
+    cpu_budget percent of the CPU, or whatever the other programs leave, if that is
+    less. With psutil the disks are sampled as well, and other programs keeping them
+    busy slow the scan down the same way. The governor first lowers how many detections
+    run at once, then adds a pause before each detection once only one is left.
+
+    Without psutil, worker processes are only measured on Linux; elsewhere the budget
+    caps the share of them in use while the window is in the background.
+    """
+
+    def __init__(self, api, max_concurrency: int, lower_threads: bool = False):
+        self.api = api
+        self.max_concurrency = max(1, max_concurrency)
+        self.lower_threads = lower_threads
+        self.limit = self.max_concurrency
+        self.pause_step = 0
+        self.throttled = False
+
+        self._active = 0
+        self._condition = threading.Condition()
+        self._stop_event = threading.Event()
+        self._sampler = _LoadSampler()
+        self._thread = None
+        self._lowered = threading.local()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True, name="ResourceGovernor")
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        with self._condition:
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+
+    @contextmanager
+    def slot(self):
+        """Wraps one detection, waiting for a free slot and any pause the governor asks for"""
+        if self.lower_threads and not getattr(self._lowered, 'done', False):
+            lower_thread_priority()
+            self._lowered.done = True
+
+        pause = PAUSE_STEPS[self.pause_step]
+        if pause > 0:
+            self._stop_event.wait(pause)
+
+        with self._condition:
+            while self._active >= self.limit and not self._stop_event.is_set():
+                self._condition.wait()
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._active -= 1
+                self._condition.notify()
+
+    def _set_full_speed(self):
+        with self._condition:
+            self.limit = self.max_concurrency
+            self.pause_step = 0
+            self._condition.notify_all()
+
+    def _hold_share(self, budget: float):
+        with self._condition:
+            self.limit = max(1, round(self.max_concurrency * budget / 100))
+            self.pause_step = 0
+            self._condition.notify_all()
+
+    def _run(self):
+        while not self._stop_event.wait(SAMPLE_INTERVAL):
+            system, own = self._sampler.sample()
+            disk_other, disk_own = self._sampler.sample_disk()
+
+            if not self.api.get_dynamic_resources() or self.api.is_window_foreground():
+                self._set_full_speed()
+                self._report(False)
+                continue
+
+            budget = self.api.get_cpu_budget()
+
+            if own is None:
+                # The worker processes cannot be measured, so the budget caps how many work
+                self._hold_share(budget)
+                self._report(self.limit < self.max_concurrency)
+                continue
+
+            disk_busy = disk_other is not None and disk_other >= IDLE_LOAD_PERCENT
+
+            if system is None:
+                # Nothing to measure the other programs with, so hold the configured budget
+                target = budget
+            else:
+                other = max(0.0, system - own)
+                if other < IDLE_LOAD_PERCENT and not disk_busy:
+                    self._set_full_speed()
+                    self._report(False)
+                    continue
+                target = min(budget, max(5.0, 100.0 - other))
+
+            if disk_busy:
+                # Our share of the disk time counts like CPU use while others wait on the disk
+                own = max(own, disk_own)
+                target = min(target, max(5.0, 100.0 - disk_other))
+
+            self._adjust(own, target)
+            self._report(self.limit < self.max_concurrency or self.pause_step > 0)
+
+    def _adjust(self, own: float, target: float):
+        with self._condition:
+            if own > target:
+                if self.limit > 1:
+                    self.limit -= 1
+                elif self.pause_step < len(PAUSE_STEPS) - 1:
+                    self.pause_step += 1
+            elif own < target * 0.7:
+                if self.pause_step > 0:
+                    self.pause_step -= 1
+                elif self.limit < self.max_concurrency:
+                    self.limit += 1
+                    self._condition.notify()
+
+    def _report(self, throttled: bool):
+        if throttled == self.throttled:
+            return
+        self.throttled = throttled
+        if throttled:
+            self.api.update_status("System busy - scanning slowed down to stay within CPU budget")
+        else:
+            self.api.update_status("System idle - scanning at full speed")
@@ -0,0 +1,150 @@
+import queue
+import threading
+import time
+from typing import Callable, Iterable, Dict, List, Optional
+
+_END = object()
+
+
+class PipelineStage:
+    def __init__(self, name: str, func: Callable, num_threads: int, input_queue: queue.Queue,
+                 batch_size: int = 0, batch_wait: float = 0.0):
+        self.name = name
+        self.func = func
+        self.num_threads = max(1, num_threads)
+        self.input_queue = input_queue
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.next_stage: Optional['PipelineStage'] = None
+        self.processed = 0
+        self.threads = []
+        self._finished = 0
+        self._lock = threading.Lock()
+
+    def start(self):
+        for i in range(self.num_threads):
+            thread = threading.Thread(
+                target=self._loop,
+                daemon=True,
+                name=f"Scan-{self.name}-{i}"
+            )
+            thread.start()
+            self.threads.append(thread)
+
+    def _loop(self):
+        if self.batch_size > 0:
+            self._batch_loop()
+        else:
+            self._item_loop()
+
+        with self._lock:
+            self._finished += 1
+            last_thread = self._finished == self.num_threads
+
+        # The last thread out hands one end marker to every thread of the next stage
+        if last_thread and self.next_stage is not None:
+            for _ in range(self.next_stage.num_threads):
+                self.next_stage.input_queue.put(_END)
+
+    def _item_loop(self):
+        while True:
+            item = self.input_queue.get()
+            if item is _END:
+                break
+
+            try:
+                result = self.func(item)
+            except Exception as e:
+                print(f"Scan stage '{self.name}' error: {e}")
+                result = None
+
+            with self._lock:
+                self.processed += 1
+
+            self._forward([result])
+
+    def _batch_loop(self):
+        """Calls func with lists of up to batch_size items, waiting at most batch_wait
+        seconds after the first one for the rest to arrive"""
+        ended = False
+        while not ended:
+            item = self.input_queue.get()
+            if item is _END:
+                break
+
+            batch = [item]
+            deadline = time.monotonic() + self.batch_wait
+            while len(batch) < self.batch_size:
+                try:
+                    item = self.input_queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is _END:
+                    ended = True
+                    break
+                batch.append(item)
+
+            try:
+                results = self.func(batch)
+            except Exception as e:
+                print(f"Scan stage '{self.name}' error: {e}")
+                results = []
+
+            with self._lock:
+                self.processed += len(batch)
+
+            self._forward(results)
+
+    def _forward(self, results: list):
+        if self.next_stage is not None:
+            for result in results:
+                if result is not None:
+                    self.next_stage.input_queue.put(result)
+
+
+class ScanPipeline:
+    """Runs items through stages connected by bounded queues.
+
+    A stage blocks when the queue in front of the next stage is full, so memory stays
+    bounded and the slowest stage (usually inference) sets the pace for the ones before it.
+    """
+
+    def __init__(self, queue_size: int = 8):
+        self.queue_size = queue_size
+        self.stages: List[PipelineStage] = []
+
+    def add_stage(self, name: str, func: Callable, num_threads: int = 1):
+        stage = PipelineStage(name, func, num_threads, queue.Queue(maxsize=self.queue_size))
+        self._append(stage)
+
+    def add_batch_stage(self, name: str, func: Callable, batch_size: int, batch_wait: float = 1.0):
+        """A single threaded stage whose func takes a list of items and returns a list"""
+        stage = PipelineStage(
+            name, func, 1, queue.Queue(maxsize=self.queue_size), batch_size=batch_size, batch_wait=batch_wait
+        )
+        self._append(stage)
+
+    def _append(self, stage: PipelineStage):
+        if self.stages:
+            self.stages[-1].next_stage = stage
+        self.stages.append(stage)
+
+    def run(self, items: Iterable):
+        """Feeds items through every stage and returns once the last stage has drained"""
+        for stage in self.stages:
+            stage.start()
+
+        first_stage = self.stages[0]
+        for item in items:
+            first_stage.input_queue.put(item)
+
+        for _ in range(first_stage.num_threads):
+            first_stage.input_queue.put(_END)
+
+        for stage in self.stages:
+            for thread in stage.threads:
+                thread.join()
+
+    def get_queue_depths(self) -> Dict[str, int]:
+        """Items waiting in front of each stage"""
+        return {stage.name: stage.input_queue.qsize() for stage in self.stages}
@@ -29,7 +29,20 @@ class Settings:
             'hide_unnamed_persons': False,
             'scan_frequency': 'restart_1_day',
             'last_scan_time': None,
-            'show_face_tags_preview': True
+            'show_face_tags_preview': True,
+            'scan_workers': 0,
+            'scan_io_threads': 4,
+            'scan_decode_threads': 2,
+            'scan_queue_size': 8,
+            'discovery_threads': 8,
+            'watch_folders': False,
+            'cpu_budget': 50,
+            'detection_mode': 'full',
+            'model_pack': 'buffalo_l',
+            'embedding_precision': 'float32',
+            'cluster_max_neighbors': 0,
+            'cluster_graph': 'auto',
+            'ann_probes': 8
         }
         
         self.settings = self.load()
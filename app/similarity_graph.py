@@ -0,0 +1,67 @@
+from typing import Tuple
+import numpy as np
+
+
+class SimilarityGraph:
+    """Undirected weighted face graph in CSR form.
+
+    The neighbors of node i are indices[indptr[i]:indptr[i + 1]] with the matching
+    weights. Every edge is stored in both directions, sorted by node.
+    """
+
+    def __init__(self, n_nodes: int, indptr: np.ndarray, indices: np.ndarray, weights: np.ndarray):
+        self.n_nodes = n_nodes
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+
+    @property
+    def edge_count(self) -> int:
+        """Undirected edges, each counted once"""
+        return len(self.indices) // 2
+
+    @property
+    def connected_count(self) -> int:
+        return int(np.count_nonzero(np.diff(self.indptr)))
+
+    @classmethod
+    def from_pairs(cls, n_nodes: int, rows: np.ndarray, cols: np.ndarray, weights: np.ndarray,
+                   max_neighbors: int = 0) -> 'SimilarityGraph':
+        """Builds the graph from pairs with rows < cols, each pair listed once.
+
+        With max_neighbors, every node keeps only its strongest edges; an edge stays when
+        either end keeps it, so the graph remains symmetric.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        weights = np.asarray(weights, dtype=np.float32)
+
+        if max_neighbors > 0 and len(rows) > 0:
+            rows, cols, weights = cls._keep_strongest(n_nodes, rows, cols, weights, max_neighbors)
+
+        sources = np.concatenate([rows, cols])
+        targets = np.concatenate([cols, rows])
+        both_weights = np.concatenate([weights, weights])
+
+        order = np.lexsort((targets, sources))
+        indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=n_nodes), out=indptr[1:])
+        return cls(n_nodes, indptr, targets[order].astype(np.int32), both_weights[order])
+
+    @staticmethod
+    def _keep_strongest(n_nodes: int, rows: np.ndarray, cols: np.ndarray, weights: np.ndarray,
+                        max_neighbors: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        pair_ids = np.arange(len(rows))
+        sources = np.concatenate([rows, cols])
+        directed_pairs = np.concatenate([pair_ids, pair_ids])
+        directed_weights = np.concatenate([weights, weights])
+
+        # Rank each node's edges by weight, strongest first
+        order = np.lexsort((-directed_weights, sources))
+        starts = np.zeros(n_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=n_nodes), out=starts[1:])
+        ranks = np.arange(len(order)) - starts[sources[order]]
+
+        keep = np.zeros(len(rows), dtype=bool)
+        keep[directed_pairs[order[ranks < max_neighbors]]] = True
+        return rows[keep], cols[keep], weights[keep]
@@ -9,6 +9,7 @@ let people = [];
         let minPhotosEnabled = false;
         let minPhotosCount = 2;
         let currentPhotoContext = null;
+        const MAX_LOG_ENTRIES = 5000;
         let currentSortMode = 'names_asc';
         let menuCloseTimeout = null;
         let renameContext = null;
@@ -1051,6 +1052,12 @@ let people = [];
             addLogEntry(message);
         }
 
+        function updateStatusMessages(messages) {
+            if (messages.length === 0) return;
+            document.getElementById('progressText').textContent = messages[messages.length - 1];
+            messages.forEach(message => addLogEntry(message));
+        }
+
         function updateProgress(current, total, percent) {
             document.getElementById('progressFill').style.width = percent + '%';
             document.getElementById('progressText').textContent = `Scanning: ${current}/${total}`;
@@ -1078,6 +1085,9 @@ let people = [];
             entry.className = 'log-entry';
             entry.textContent = `[${timestamp}] ${message}`;
             logViewer.appendChild(entry);
+            while (logViewer.childElementCount > MAX_LOG_ENTRIES) {
+                logViewer.removeChild(logViewer.firstElementChild);
+            }
             logViewer.scrollTop = logViewer.scrollHeight;
         }
 
@@ -1092,12 +1102,37 @@ let people = [];
                 const scanFrequency = await pywebview.api.get_scan_frequency();
                 document.getElementById('scanFrequencyDropdown').value = scanFrequency;
                 
+                const watchFolders = await pywebview.api.get_watch_folders();
+                document.getElementById('watchFoldersToggle').checked = watchFolders;
+                
+                const modelPack = await pywebview.api.get_model_pack();
+                const availablePacks = await pywebview.api.get_available_model_packs();
+                for (const option of document.getElementById('modelPackDropdown').options) {
+                    option.disabled = !availablePacks.includes(option.value);
+                }
+                document.getElementById('modelPackDropdown').value = modelPack;
+                
+                const embeddingPrecision = await pywebview.api.get_embedding_precision();
+                document.getElementById('embeddingPrecisionDropdown').value = embeddingPrecision;
+                
+                const clusterGraph = await pywebview.api.get_cluster_graph();
+                document.getElementById('clusterGraphDropdown').value = clusterGraph;
+                
+                const detectionMode = await pywebview.api.get_detection_mode();
+                document.getElementById('detectionModeDropdown').value = detectionMode;
+                
+                const scanWorkers = await pywebview.api.get_scan_workers();
+                document.getElementById('scanWorkersDropdown').value = String(scanWorkers);
+                
                 const closeToTray = await pywebview.api.get_close_to_tray();
                 document.getElementById('closeToTrayToggle').checked = closeToTray;
                 
                 const dynamicResources = await pywebview.api.get_dynamic_resources();
                 document.getElementById('dynamicResourcesToggle').checked = dynamicResources;
                 
+                const cpuBudget = await pywebview.api.get_cpu_budget();
+                document.getElementById('cpuBudgetDropdown').value = String(cpuBudget);
+                
                 const showUnmatchedSetting = await pywebview.api.get_show_unmatched();
                 showUnmatched = showUnmatchedSetting;
                 document.getElementById('showUnmatchedToggle').checked = showUnmatchedSetting;
@@ -1161,6 +1196,8 @@ let people = [];
                 const wildcards = await pywebview.api.get_wildcard_exclusions();
                 document.getElementById('wildcardInput').value = wildcards;
                 
+                await loadQuarantinedFiles();
+                
                 await updateCacheSize();
 
                 addLogEntry('Settings loaded successfully');
@@ -1194,6 +1231,79 @@ let people = [];
             }
         });
 
+        document.getElementById('watchFoldersToggle').addEventListener('change', async (e) => {
+            try {
+                await pywebview.api.set_watch_folders(e.target.checked);
+                addLogEntry('Watch folders for changes: ' + (e.target.checked ? 'enabled' : 'disabled'));
+            } catch (error) {
+                console.error('Error changing folder watching:', error);
+                addLogEntry('ERROR: Failed to change folder watching - ' + error);
+            }
+        });
+
+        document.getElementById('modelPackDropdown').addEventListener('change', async (e) => {
+            const modelPack = e.target.value;
+            try {
+                const result = await pywebview.api.set_model_pack(modelPack);
+                if (result.success) {
+                    addLogEntry('Face model changed to: ' + modelPack);
+                } else {
+                    e.target.value = await pywebview.api.get_model_pack();
+                    addLogEntry('Face model not changed: ' + result.message);
+                }
+            } catch (error) {
+                console.error('Error changing face model:', error);
+                addLogEntry('ERROR: Failed to change face model - ' + error);
+            }
+        });
+
+        document.getElementById('embeddingPrecisionDropdown').addEventListener('change', async (e) => {
+            const precision = e.target.value;
+            try {
+                await pywebview.api.set_embedding_precision(precision);
+                addLogEntry('Embedding precision changed to: ' + precision + ' (applies on the next clustering)');
+                
+                const report = await pywebview.api.get_embedding_precision_report();
+                report.forEach(line => addLogEntry(line));
+            } catch (error) {
+                console.error('Error changing embedding precision:', error);
+                addLogEntry('ERROR: Failed to change embedding precision - ' + error);
+            }
+        });
+
+        document.getElementById('clusterGraphDropdown').addEventListener('change', async (e) => {
+            const mode = e.target.value;
+            try {
+                await pywebview.api.set_cluster_graph(mode);
+                addLogEntry('People grouping search changed to: ' + mode + ' (applies on the next clustering)');
+            } catch (error) {
+                console.error('Error changing grouping search:', error);
+                addLogEntry('ERROR: Failed to change grouping search - ' + error);
+            }
+        });
+
+        document.getElementById('detectionModeDropdown').addEventListener('change', async (e) => {
+            const mode = e.target.value;
+            try {
+                await pywebview.api.set_detection_mode(mode);
+                addLogEntry('Face detection mode changed to: ' + (mode === 'cascade' ? 'fast' : 'full') + ' (applies from next scan)');
+            } catch (error) {
+                console.error('Error changing detection mode:', error);
+                addLogEntry('ERROR: Failed to change face detection mode - ' + error);
+            }
+        });
+
+        document.getElementById('scanWorkersDropdown').addEventListener('change', async (e) => {
+            const count = parseInt(e.target.value);
+            try {
+                await pywebview.api.set_scan_workers(count);
+                addLogEntry('Scan worker processes changed to: ' + (count === 0 ? 'auto' : count) + ' (applies from next scan)');
+            } catch (error) {
+                console.error('Error changing scan workers:', error);
+                addLogEntry('ERROR: Failed to change scan worker processes - ' + error);
+            }
+        });
+
         document.getElementById('hideUnnamedToggle').addEventListener('change', async (e) => {
             hideUnnamedPersons = e.target.checked;
             await pywebview.api.set_hide_unnamed_persons(hideUnnamedPersons);
@@ -1604,12 +1714,23 @@ let people = [];
         document.getElementById('dynamicResourcesToggle').addEventListener('change', (e) => {
             pywebview.api.set_dynamic_resources(e.target.checked);
             if (e.target.checked) {
-                addLogEntry('Dynamic resource management enabled - will throttle CPU to 5% when in background');
+                addLogEntry('Dynamic resource management enabled - will throttle to the CPU budget when in background and the system is busy');
             } else {
                 addLogEntry('Dynamic resource management disabled - full speed processing');
             }
         });
 
+        document.getElementById('cpuBudgetDropdown').addEventListener('change', async (e) => {
+            const percent = parseInt(e.target.value);
+            try {
+                await pywebview.api.set_cpu_budget(percent);
+                addLogEntry('Background CPU budget changed to: ' + percent + '%');
+            } catch (error) {
+                console.error('Error changing CPU budget:', error);
+                addLogEntry('ERROR: Failed to change CPU budget - ' + error);
+            }
+        });
+
         document.getElementById('saveLogBtn').addEventListener('click', async () => {
             const logViewer = document.getElementById('logViewer');
             const logContent = logViewer.innerText;
@@ -1686,6 +1807,35 @@ let people = [];
             });
         }
 
+        async function loadQuarantinedFiles() {
+            const container = document.getElementById('quarantinedFiles');
+            const photos = await pywebview.api.get_quarantined_photos();
+            container.innerHTML = '';
+            
+            if (photos.length === 0) {
+                container.innerHTML = '<div style="color: #606060; padding: 12px; text-align: center; font-size: 13px;">No quarantined files</div>';
+                return;
+            }
+            
+            photos.forEach(photo => {
+                const item = document.createElement('div');
+                item.className = 'folder-item';
+                item.setAttribute('data-path', photo.file_path);
+                item.textContent = `${photo.file_path} (failed ${photo.error_count} times)`;
+                container.appendChild(item);
+            });
+        }
+
+        document.getElementById('retryQuarantinedBtn').addEventListener('click', async () => {
+            try {
+                await pywebview.api.retry_quarantined_photos();
+                await loadQuarantinedFiles();
+            } catch (error) {
+                console.error('Error retrying quarantined files:', error);
+                addLogEntry('ERROR: Failed to retry quarantined files - ' + error);
+            }
+        });
+
         document.getElementById('addIncludeBtn').addEventListener('click', async () => {
             try {
                 const folder = await pywebview.api.select_folder();
@@ -1766,7 +1916,7 @@ let people = [];
             closeSettings();
             
             try {
-                await pywebview.api.start_scanning();
+                await pywebview.api.start_scanning(true);
                 addLogEntry('Manual rescan initiated');
             } catch (error) {
                 console.error('Error starting rescan:', error);
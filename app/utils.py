@@ -23,6 +23,11 @@ def get_appdata_path():
         return Path.home() / "AppData" / "Roaming" / "facial_recognition" / "face_data"
 
 
+def get_file_fingerprint(stat_result) -> tuple:
+    """(size, mtime_ns, inode) used to tell whether a file changed without reading it"""
+    return (stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino)
+
+
 def get_insightface_root():
     """
     Get the InsightFace model root path.
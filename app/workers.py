@@ -1,311 +1,877 @@
 import os
-import hashlib
+import json
 import time
+import queue
 import threading
-import fnmatch
 import random
-from pathlib import Path
 from typing import Optional, Tuple, List
 import numpy as np
-import cv2
-from PIL import Image, ImageOps
-from insightface.app import FaceAnalysis
 import networkx as nx
 import torch
 
-from utils import get_insightface_root
+from utils import get_insightface_root, get_file_fingerprint
+from face_engine import (
+    DetectionPool, create_face_app, read_file, hash_bytes, legacy_hash_bytes, is_legacy_hash, decode_image, analyze_image, embed_crops, embed_faces,
+    extract_preview, resolve_worker_count, DEFAULT_MODEL_PACK
+)
+from embedding_store import EmbeddingMatrix, measure_precision, format_precision_report
+from similarity_graph import SimilarityGraph
+from scan_pipeline import ScanPipeline
+from path_filter import PathFilter
+from discovery import PhotoDiscovery, IMAGE_EXTENSIONS
+from resource_governor import ResourceGovernor
 
 GPU_AVAILABLE = torch.cuda.is_available()
 DEVICE = torch.device('cuda' if GPU_AVAILABLE else 'cpu')
 
+# A photo that keeps failing is retried after 1h, 2h, 4h, ... and quarantined after this many failures
+MAX_SCAN_FAILURES = 5
+RETRY_BACKOFF_SECONDS = 3600
+# Photos whose faces are embedded together; the stage waits at most EMBED_BATCH_WAIT
+# seconds for a batch to fill, so a slow trickle of photos is not held back
+EMBED_BATCH_PHOTOS = 16
+EMBED_BATCH_WAIT = 1.0
+# Column chunk of the similarity blocks, rows are converted to float32 only chunk by chunk
+# so the whole matrix stays in its storage precision
+SIMILARITY_CHUNK = 16384
+# Embeddings sampled to report how far a reduced precision is from float32
+PRECISION_SAMPLE = 2000
+# In auto mode the graph comes from the ANN index above these face counts; exact all-pairs
+# similarity grows with the square of the faces, which a GPU absorbs for much longer
+ANN_MIN_FACES_CPU = 30000
+ANN_MIN_FACES_GPU = 300000
+# Neighbors kept per face with the ANN index when max_neighbors is not set
+ANN_DEFAULT_NEIGHBORS = 64
+
+
+class _HeldStatus:
+    """Stands in for the api during a background scan, holding its status messages back
+    until the scan finds something to do, so scans that change nothing stay silent"""
+    
+    def __init__(self, api):
+        self._api = api
+        self._held = []
+        self._lock = threading.Lock()
+        self.released = False
+    
+    def __getattr__(self, name):
+        return getattr(self._api, name)
+    
+    def update_status(self, message: str):
+        with self._lock:
+            if not self.released:
+                self._held.append(message)
+                return
+        self._api.update_status(message)
+    
+    def update_progress(self, current: int, total: int):
+        if self.released:
+            self._api.update_progress(current, total)
+    
+    def release(self):
+        with self._lock:
+            if self.released:
+                return
+            self.released = True
+            held, self._held = self._held, []
+        for message in held:
+            self._api.update_status(message)
+
 
 class ScanWorker(threading.Thread):
-    def __init__(self, db, api):
+    def __init__(self, db, api, full_rescan: bool = False, changes: Optional[dict] = None, quiet: bool = False):
         super().__init__()
         self.db = db
-        self.api = api
+        self.quiet = quiet
+        self.api = _HeldStatus(api) if quiet else api
         self.face_app = None
         self.daemon = True
         self.batch_size = 25
+        self.num_workers = 1
+        self.full_rescan = full_rescan
+        self.changes = changes
+        self.pool = None
+        self.pipeline = None
+        self.pipeline_thread = None
+        self.aborted = False
+        self.hash_index = {}
+        self.legacy_hashes = False
+        self._model_lock = threading.Lock()
+        self._model_failed = False
+    
+    def run(self):
+        self.api.set_new_photos_found(False)
+        self.api.set_photos_deleted(False)
+        try:
+            self.scan()
+        except Exception as e:
+            self.show_status()
+            self.api.update_status(f"ERROR: Scan failed: {str(e)}")
+        finally:
+            self.abort_pipeline()
+            self.api.scan_complete(quiet=self.quiet and not self.api.released)
     
-    def should_exclude_path(self, path: str) -> bool:
+    def scan(self):
         include_folders = self.api.get_include_folders()
-        exclude_folders = self.api.get_exclude_folders()
-        wildcard_text = self.api.get_wildcard_exclusions()
-        
-        path_normalized = os.path.normpath(path)
         
         if not include_folders:
-            return False
-        
-        is_in_include = False
-        for include_folder in include_folders:
-            include_normalized = os.path.normpath(include_folder)
-            if path_normalized.startswith(include_normalized):
-                is_in_include = True
-                break
+            self.api.update_status("No folders configured for scanning")
+            self.api.update_status("Please add folders in Settings > Folders to Scan")
+            return
         
-        if not is_in_include:
-            return True
+        if self.changes is None:
+            for location in include_folders:
+                if not os.path.exists(location):
+                    self.api.update_status(f"WARNING: Folder does not exist: {location}")
+        
+        self.num_workers = resolve_worker_count(self.api.get_scan_workers())
+        self.model_pack = self.resolve_model_pack()
+        
+        path_filter = PathFilter(
+            include_folders,
+            self.api.get_exclude_folders(),
+            self.api.get_wildcard_exclusions()
+        )
+        
+        self.known_photos = self.db.get_photo_fingerprints()
+        self.known_by_size = {}
+        for file_path, row in self.known_photos.items():
+            if row['file_size'] is not None:
+                self.known_by_size.setdefault(row['file_size'], []).append(file_path)
+        
+        self.hash_index = self.db.get_completed_hash_index()
+        # Photos scanned by older versions keep their MD5 until they change, so copies and
+        # moves of them are also matched by MD5 as long as any are left
+        self.legacy_hashes = any(is_legacy_hash(row['file_hash']) for row in self.known_photos.values())
+        self.discovered = {}
+        self.deferred_new = []
+        self.backfill = []
+        self.scan_counts = {'new': 0, 'modified': 0, 'retry': 0}
+        self.retry_skipped = 0
+        self._discovery_lock = threading.Lock()
+        
+        self.enqueued = []
+        self.committed_paths = set()
+        self.journal_pending = None
+        self._journal_lock = threading.Lock()
+        
+        # Full scans keep a journal, so a run killed mid-way resumes without walking again
+        self.run_id = None
+        resume_run = None
+        rules_signature = self.get_rules_signature(include_folders)
+        if self.changes is None:
+            if not self.full_rescan:
+                resume_run = self.db.get_resumable_scan_run(rules_signature)
+            if resume_run is None:
+                self.run_id = self.db.start_scan_run(rules_signature)
+            else:
+                self.run_id = resume_run['run_id']
         
-        for exclude_folder in exclude_folders:
-            exclude_normalized = os.path.normpath(exclude_folder)
-            if path_normalized.startswith(exclude_normalized):
-                return True
+        # Discovered files stream into the pipeline while the walk is still running
+        self.start_pipeline()
         
-        if wildcard_text:
-            wildcards = [w.strip() for w in wildcard_text.split(',') if w.strip()]
+        if resume_run is not None:
+            moves = self.resume_scan_run(resume_run)
+            existing_paths = {
+                os.path.join(dir_path, name)
+                for dir_path, entry in self.db.get_directory_index().items()
+                for name in entry['files']
+            }
+        elif self.changes is None:
+            discovery = self.discover_all(include_folders, path_filter, rules_signature)
+            vanished = {
+                file_path: row for file_path, row in self.known_photos.items()
+                if file_path not in self.discovered
+            }
+            moves = self.queue_deferred_photos(vanished)
+            existing_paths = set(self.discovered)
             
-            for wildcard in wildcards:
-                wildcard_normalized = os.path.normpath(wildcard)
-                
-                if os.path.isabs(wildcard_normalized):
-                    if path_normalized.startswith(wildcard_normalized):
-                        return True
-                else:
-                    path_parts = path_normalized.split(os.sep)
-                    filename = os.path.basename(path_normalized)
-                    
-                    if fnmatch.fnmatch(filename, wildcard):
-                        return True
-                    
-                    for part in path_parts:
-                        if fnmatch.fnmatch(part, wildcard):
-                            return True
+            # Handed to the writer stage, which stays the only database writer during the scan
+            with self._journal_lock:
+                self.journal_pending = {
+                    'items': list(self.enqueued),
+                    'moves': moves,
+                    'directories': discovery.directories,
+                    'rules': rules_signature
+                }
+        else:
+            self.discover_changes(path_filter)
+            vanished = self.find_vanished_under(self.changes['removed'])
+            moves = self.queue_deferred_photos(vanished)
+            existing_paths = None
+        
+        self.finish_pipeline()
+        
+        if self._model_failed:
+            # The journal of a full scan keeps the unscanned photos for the next run
+            self.show_status()
+            self.api.update_status("Scan aborted: the face detection model could not be loaded")
+            return
         
-        return False
+        # The pipeline has drained, so this thread is the only database writer again
+        if moves:
+            self.db.relocate_photos(moves)
+            self.api.update_status(f"Kept faces and tags for {len(moves)} moved or renamed photos")
+        
+        if existing_paths is not None:
+            self.api.update_status("Cleaning up deleted photos from database...")
+            deleted_count = self.db.remove_deleted_photos(existing_paths)
+        else:
+            moved_ids = {photo_id for photo_id, _, _ in moves}
+            deleted_count = self.db.remove_photos(
+                [row['photo_id'] for row in vanished.values() if row['photo_id'] not in moved_ids]
+            )
+        
+        if deleted_count > 0:
+            self.api.update_status(f"Removed {deleted_count} deleted photos from database")
+        
+        if self.backfill:
+            self.db.update_fingerprints(self.backfill)
+        
+        if self.run_id is not None:
+            self.db.finish_scan_run(self.run_id)
+        
+        if self.retry_skipped > 0:
+            self.api.update_status(f"Skipped {self.retry_skipped} previously failed photos until their next retry")
+        
+        self.api.set_photos_deleted(deleted_count > 0)
+        
+        scanned_total = sum(self.scan_counts.values())
+        self.api.set_new_photos_found(scanned_total > 0)
+        
+        if moves or deleted_count > 0:
+            self.show_status()
+        
+        if scanned_total == 0:
+            self.api.update_status("No new photos to scan")
+        else:
+            self.api.update_status(
+                f"Scanned {self.scan_counts['new']} new photos, {self.scan_counts['modified']} modified, "
+                f"{self.scan_counts['retry']} incomplete"
+            )
+    
+    def show_status(self):
+        """A background scan shows its held messages once it has something to report"""
+        if self.quiet:
+            self.api.release()
     
-    def load_image(self, file_path: str) -> Optional[np.ndarray]:
-        file_ext = Path(file_path).suffix.lower()
+    def resolve_model_pack(self) -> str:
+        """Embeddings of different packs cannot be compared, so stored faces pin the pack"""
+        model_pack = self.api.get_model_pack()
+        has_faces = self.db.get_total_faces() > 0
+        stored_pack = self.db.get_meta('model_pack', DEFAULT_MODEL_PACK if has_faces else None)
+        
+        if has_faces and stored_pack != model_pack:
+            self.api.update_status(
+                f"WARNING: Existing faces were detected with {stored_pack}, continuing with it instead of {model_pack}"
+            )
+            return stored_pack
         
-        try:
-            pil_image = Image.open(file_path)
-            pil_image = ImageOps.exif_transpose(pil_image)
-            image_rgb = np.array(pil_image.convert('RGB'))
-            image_bgr = cv2.cvtColor(image_rgb, cv2.COLOR_RGB2BGR)
-            return image_bgr
-            
-        except Exception as e:
-            self.api.update_status(f"ERROR: Cannot read image - {os.path.basename(file_path)}: {str(e)}")
-            return None
-
-    def run(self):
-        try:
-            self.api.update_status("Initializing InsightFace model...")
+        if stored_pack != model_pack:
+            self.db.set_meta('model_pack', model_pack)
+        return model_pack
+    
+    def discover_all(self, include_folders: List[str], path_filter: PathFilter, rules_signature: str) -> PhotoDiscovery:
+        directory_index = None
+        if not self.full_rescan and self.db.get_meta('directory_index_rules') == rules_signature:
+            directory_index = self.db.get_directory_index()
+        
+        self.api.update_status("Discovering photos..." if directory_index is None else
+                               "Discovering photos (skipping unchanged folders)...")
+        discovery = PhotoDiscovery(
+            path_filter, directory_index,
+            num_threads=self.api.get_scan_pipeline_config()['discovery_threads']
+        )
+        discovery.run(include_folders, self.on_file_discovered)
+        
+        self.api.update_status(
+            f"Found {len(self.discovered)} images after applying exclusions "
+            f"({discovery.listed_count} folders listed, {discovery.skipped_count} unchanged)"
+        )
+        return discovery
+    
+    def resume_scan_run(self, resume_run: dict) -> List[tuple]:
+        items = self.db.get_scan_run_items(resume_run['run_id'])
+        remaining = [item for item in items if not item['done']]
+        self.api.update_status(f"Resuming interrupted scan: {len(remaining)} of {len(items)} photos left")
+        
+        for item in remaining:
+            row = self.known_photos.get(item['file_path'])
+            if item['kind'] == 'modified' and row and self.hash_index.get(row['file_hash']) == row['photo_id']:
+                del self.hash_index[row['file_hash']]
+            self.enqueue_photo(item['file_path'], item['kind'], item['photo_id'])
+        
+        return [(photo_id, path, tuple(fingerprint)) for photo_id, path, fingerprint in resume_run['moves']]
+    
+    def queue_deferred_photos(self, vanished: dict) -> List[tuple]:
+        """Settles new files held back as possible moves, queueing those that were not moves"""
+        if not self.deferred_new:
+            return []
+        
+        self.api.update_status("Checking for moved or renamed photos...")
+        moves = self.detect_moved_photos(self.deferred_new, vanished)
+        moved_paths = {new_path for _, new_path, _ in moves}
+        for file_path in self.deferred_new:
+            if file_path not in moved_paths:
+                self.enqueue_photo(file_path, 'new')
+        return moves
+    
+    def discover_changes(self, path_filter: PathFilter):
+        """Visits only the paths reported by the folder watcher, walking new folders in full"""
+        self.api.update_status(
+            f"Processing {len(self.changes['updated'])} changed and {len(self.changes['removed'])} removed paths..."
+        )
+        
+        new_folders = []
+        for path in sorted(self.changes['updated']):
+            if os.path.isdir(path):
+                new_folders.append(path)
+                continue
             
-            model_root = get_insightface_root()
+            if os.path.splitext(path)[1].lower() not in IMAGE_EXTENSIONS or path_filter.is_excluded(path):
+                continue
             
-            self.face_app = FaceAnalysis(
-                name='buffalo_l',
-                root=model_root,
-                providers=['CPUExecutionProvider']
+            try:
+                fingerprint = get_file_fingerprint(os.stat(path))
+            except OSError:
+                continue
+            self.on_file_discovered(path, fingerprint)
+        
+        if new_folders:
+            discovery = PhotoDiscovery(
+                path_filter, None,
+                num_threads=self.api.get_scan_pipeline_config()['discovery_threads']
             )
-            self.face_app.prepare(ctx_id=-1, det_size=(640, 640))
-            self.api.update_status("Model loaded")
-        except Exception as e:
-            self.api.update_status(f"Error loading model: {e}")
-            return
+            discovery.run(new_folders, self.on_file_discovered)
+    
+    def find_vanished_under(self, removed_paths: set) -> dict:
+        """Known photos that are gone from disk and were at, or below, a removed path"""
+        removed = {os.path.normcase(os.path.normpath(path)) for path in removed_paths}
+        vanished = {}
         
-        include_folders = self.api.get_include_folders()
+        for file_path, row in self.known_photos.items():
+            if file_path in self.discovered:
+                continue
+            
+            current = os.path.normcase(os.path.normpath(file_path))
+            while True:
+                if current in removed:
+                    if not os.path.exists(file_path):
+                        vanished[file_path] = row
+                    break
+                parent = os.path.dirname(current)
+                if parent == current:
+                    break
+                current = parent
+        
+        return vanished
+    
+    def get_rules_signature(self, include_folders: List[str]) -> str:
+        rules = {
+            'include': include_folders,
+            'exclude': self.api.get_exclude_folders(),
+            'wildcards': self.api.get_wildcard_exclusions(),
+            'extensions': sorted(IMAGE_EXTENSIONS)
+        }
+        return hash_bytes(json.dumps(rules, sort_keys=True).encode())
+    
+    def on_file_discovered(self, file_path: str, fingerprint: tuple):
+        """Classifies a file from its stat data alone, called from the discovery threads"""
+        with self._discovery_lock:
+            if file_path in self.discovered:
+                return
+            self.discovered[file_path] = fingerprint
         
-        if not include_folders:
-            self.api.update_status("No folders configured for scanning")
-            self.api.update_status("Please add folders in Settings > Folders to Scan")
-            self.api.scan_complete()
+        row = self.known_photos.get(file_path)
+        
+        if row is None:
+            if self.is_possible_move_target(fingerprint):
+                with self._discovery_lock:
+                    self.deferred_new.append(file_path)
+            else:
+                self.enqueue_photo(file_path, 'new')
             return
         
-        image_extensions = {'.jpg', '.jpeg', '.png', '.bmp', '.gif', '.heic', '.heif'}
+        size, mtime_ns, inode = fingerprint
         
-        self.api.update_status("Discovering photos...")
-        all_image_files = set()
+        if row['scan_status'] != 'completed':
+            # Failed files are only retried on schedule, or right away once they change on disk
+            unchanged = row['file_size'] == size and row['file_mtime_ns'] == mtime_ns
+            if unchanged and not self.is_retry_due(row):
+                with self._discovery_lock:
+                    self.retry_skipped += 1
+                return
+            self.enqueue_photo(file_path, 'retry')
+            return
         
-        for location in include_folders:
-            if not os.path.exists(location):
-                self.api.update_status(f"WARNING: Folder does not exist: {location}")
+        
+        # Inode is stored but not compared, network shares do not keep it stable
+        if row['file_size'] is None:
+            with self._discovery_lock:
+                self.backfill.append((row['photo_id'], fingerprint))
+        elif row['file_size'] != size or row['file_mtime_ns'] != mtime_ns:
+            if self.hash_index.get(row['file_hash']) == row['photo_id']:
+                del self.hash_index[row['file_hash']]
+            self.enqueue_photo(file_path, 'modified', row['photo_id'])
+    
+    def is_retry_due(self, row: dict) -> bool:
+        if row['scan_status'] == 'quarantined':
+            return False
+        if row['scan_status'] != 'error' or not row['error_count'] or not row['last_attempt']:
+            return True
+        backoff = RETRY_BACKOFF_SECONDS * 2 ** (row['error_count'] - 1)
+        return time.time() - row['last_attempt'] >= backoff
+    
+    def get_file_hashes(self, data: bytes) -> set:
+        file_hashes = {hash_bytes(data)}
+        if self.legacy_hashes:
+            file_hashes.add(legacy_hash_bytes(data))
+        return file_hashes
+    
+    def is_possible_move_target(self, fingerprint: tuple) -> bool:
+        """A new file is held back only if a known photo of the same size is gone from disk"""
+        for known_path in self.known_by_size.get(fingerprint[0], []):
+            if not os.path.exists(known_path):
+                return True
+        return False
+    
+    def detect_moved_photos(self, new_paths: List[str], vanished: dict) -> List[tuple]:
+        """Matches photos that vanished from their old path to newly appeared files.
+        
+        A unique size+mtime match is taken as a move without reading the file. When
+        several vanished photos share the size, or the mtime was not preserved, the
+        new file is hashed and compared against the stored content hashes.
+        """
+        vanished_by_size = {}
+        for row in vanished.values():
+            if row['file_size'] is not None:
+                vanished_by_size.setdefault(row['file_size'], []).append(row)
+        
+        moves = []
+        matched_ids = set()
+        
+        for file_path in new_paths:
+            size, mtime_ns, inode = self.discovered[file_path]
+            candidates = [row for row in vanished_by_size.get(size, []) if row['photo_id'] not in matched_ids]
+            if not candidates:
                 continue
             
-            self.api.update_status(f"Scanning folder: {location}")
+            exact = [row for row in candidates if row['file_mtime_ns'] == mtime_ns]
+            if len(exact) > 1:
+                exact = [row for row in exact if row['file_inode'] == inode] or exact
+            
+            match = exact[0] if len(exact) == 1 else None
             
-            for root, dirs, files in os.walk(location):
-                if self.should_exclude_path(root):
-                    dirs.clear()
+            if match is None:
+                try:
+                    file_hashes = self.get_file_hashes(read_file(file_path))
+                except OSError:
                     continue
-                
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    
-                    if Path(file).suffix.lower() in image_extensions:
-                        if not self.should_exclude_path(file_path):
-                            all_image_files.add(file_path)
+                match = next((row for row in candidates if row['file_hash'] in file_hashes), None)
+            
+            if match is not None:
+                matched_ids.add(match['photo_id'])
+                moves.append((match['photo_id'], file_path, self.discovered[file_path]))
+                if len(moves) <= 10:
+                    self.api.update_status(f"  MOVED: {os.path.basename(match['file_path'])} -> {file_path}")
         
-        self.api.update_status(f"Found {len(all_image_files)} images after applying exclusions")
+        if len(moves) > 10:
+            self.api.update_status(f"  ... and {len(moves) - 10} more")
         
-        self.api.update_status("Cleaning up deleted photos from database...")
-        deleted_count = self.db.remove_deleted_photos(all_image_files)
-        if deleted_count > 0:
-            self.api.update_status(f"Removed {deleted_count} deleted photos from database")
+        return moves
+    
+    def enqueue_photo(self, file_path: str, kind: str, photo_id: Optional[int] = None):
+        job = {'file_path': file_path, 'kind': kind, 'photo_id': photo_id}
+        self.show_status()
+        with self._discovery_lock:
+            self.scan_counts[kind] += 1
+            self.enqueued.append(job)
+            if self.scan_counts[kind] <= 10:
+                self.api.update_status(f"  {kind.upper()}: {os.path.basename(file_path)}")
+        self.scan_queue.put(job)
+    
+    def start_pipeline(self):
+        config = self.api.get_scan_pipeline_config()
+        
+        self.written_count = 0
+        self.pending_batch = []
+        self.batches_committed = 0
+        self.duplicate_count = 0
+        self.scan_queue = queue.Queue()
+        self.cascade = config['detection_mode'] == 'cascade'
+        self.cascade_stats = {
+            'photos': 0, 'skipped': 0, 'audited': 0, 'audit_hits': 0, 'with_faces': 0,
+            'prefilter_ms': 0.0, 'full_ms': 0.0, 'full_count': 0
+        }
+        self._stats_lock = threading.Lock()
+        
+        self.pipeline = ScanPipeline(queue_size=config['queue_size'])
+        self.pipeline.add_stage('read', self.read_stage, config['io_threads'])
+        
+        if self.num_workers > 1:
+            # Worker processes decode as well as detect, one blocking call per process
+            self.pipeline.add_stage('detect', self.pool_detect_stage, self.num_workers)
+        else:
+            self.pipeline.add_stage('decode', self.decode_stage, config['decode_threads'])
+            self.pipeline.add_stage('detect', self.detect_stage, 1)
+        
+        self.pipeline.add_batch_stage('embed', self.embed_stage, EMBED_BATCH_PHOTOS, EMBED_BATCH_WAIT)
+        self.pipeline.add_stage('write', self.write_stage, 1)
+        
+        # Detection in the app process lowers only its own threads, the window stays responsive
+        self.governor = ResourceGovernor(self.api, self.num_workers, lower_threads=self.num_workers == 1)
+        self.governor.start()
+        
+        self.pipeline_thread = threading.Thread(
+            target=self.pipeline.run,
+            args=(iter(self.scan_queue.get, None),),
+            daemon=True,
+            name="ScanPipeline"
+        )
+        self.pipeline_thread.start()
+    
+    def finish_pipeline(self):
+        self.scan_queue.put(None)
+        self.pipeline_thread.join()
+        self.pipeline_thread = None
+        self.governor.stop()
         
-        self.api.set_photos_deleted(deleted_count > 0)
+        self.write_scan_journal()
         
-        scanned_paths = self.db.get_all_scanned_paths()
-        pending_paths_all = self.db.get_pending_and_error_paths()
-        pending_paths = set(p for p in pending_paths_all if os.path.exists(p))
+        if self.pending_batch:
+            self.commit_batch(self.pending_batch)
+            self.pending_batch = []
         
-        stale_pending = len(pending_paths_all) - len(pending_paths)
-        if stale_pending > 0:
-            self.api.update_status(f"Ignoring {stale_pending} pending files that no longer exist")
+        if self.duplicate_count > 0:
+            self.api.update_status(f"Reused existing faces for {self.duplicate_count} duplicate photos")
         
-        new_photos = all_image_files - scanned_paths
-        photos_to_scan = list(new_photos | pending_paths)
+        self.report_cascade_stats()
         
-        if len(photos_to_scan) == 0:
-            self.api.update_status("No new photos to scan")
-            self.api.set_new_photos_found(False)
-            self.api.scan_complete()
-            return
+        if self.pool:
+            self.pool.close()
+            self.pool = None
+    
+    def abort_pipeline(self):
+        """Stops the pipeline threads and detection processes a failed scan left running,
+        dropping the photos still queued"""
+        self.aborted = True
+        if self.pipeline_thread is not None:
+            self.scan_queue.put(None)
+            self.pipeline_thread.join()
+            self.pipeline_thread = None
+            self.governor.stop()
+        
+        if self.pool:
+            self.pool.close()
+            self.pool = None
+    
+    def get_queue_depths(self) -> dict:
+        if self.pipeline is None:
+            return {}
+        depths = {'discovered': self.scan_queue.qsize()}
+        depths.update(self.pipeline.get_queue_depths())
+        return depths
+    
+    def get_detector(self):
+        """Loads the model, or starts the worker processes, when the first photo needs them"""
+        with self._model_lock:
+            if self._model_failed:
+                return None
+            
+            try:
+                if self.num_workers > 1:
+                    if self.pool is None:
+                        self.api.update_status(f"Starting {self.num_workers} detection processes...")
+                        self.pool = DetectionPool(self.num_workers, model_pack=self.model_pack)
+                        self.api.update_status(
+                            f"Detection processes ready ({self.pool.onnx_threads} ONNX threads each)"
+                        )
+                    return self.pool
+                
+                if self.face_app is None:
+                    self.api.update_status(f"Initializing InsightFace model ({self.model_pack})...")
+                    self.face_app = create_face_app(get_insightface_root(), model_pack=self.model_pack)
+                    self.api.update_status("Model loaded")
+                return self.face_app
+            except Exception as e:
+                self._model_failed = True
+                self.api.update_status(f"Error loading model: {e}")
+                return None
+    
+    def read_stage(self, job: dict) -> Optional[dict]:
+        if self.aborted or self._model_failed:
+            return None
         
-        self.api.set_new_photos_found(len(new_photos) > 0)
+        file_path = job['file_path']
         
-        total = len(photos_to_scan)
-        total_photos = len(all_image_files)
-        scanned_count = total_photos - total
+        try:
+            fingerprint = get_file_fingerprint(os.stat(file_path))
+        except OSError:
+            self.api.update_status(f"ERROR: File not found - {os.path.basename(file_path)}")
+            return None
         
-        self.api.update_status(f"Found {len(new_photos)} new photos, {len(pending_paths)} incomplete")
+        item = {
+            'file_path': file_path,
+            'kind': job['kind'],
+            'reset_photo_id': job['photo_id'] if job['kind'] == 'modified' else None,
+            'file_hash': None,
+            'fingerprint': fingerprint,
+            'status': 'pending',
+            'faces': [],
+            'error': None
+        }
+        
+        # The file is read once: the same buffer is hashed here and decoded downstream
+        try:
+            data = read_file(file_path)
+        except Exception as e:
+            # Recorded as a failed attempt so unreadable files fall under the retry backoff
+            item['status'] = 'error'
+            item['error'] = f"Cannot read file: {str(e)}"
+            return item
+        
+        item['file_hash'] = hash_bytes(data)
+        item['data'] = data
+        
+        # Copies of an already scanned photo reuse its faces and never reach the detector
+        source_photo_id = self.hash_index.get(item['file_hash'])
+        if source_photo_id is None and self.legacy_hashes:
+            source_photo_id = self.hash_index.get(legacy_hash_bytes(data))
+        if source_photo_id is not None:
+            faces = self.db.get_photo_faces_with_embeddings(source_photo_id)
+            if faces is not None:
+                del item['data']
+                item['status'] = 'duplicate'
+                item['faces'] = faces
+        
+        return item
+    
+    def decode_stage(self, item: dict) -> dict:
+        if item['status'] != 'pending':
+            return item
         
-        if len(new_photos) > 0:
-            self.api.update_status(f"New photos detected: {len(new_photos)} files")
-            new_photos_list = sorted(list(new_photos))
-            for i, photo_path in enumerate(new_photos_list[:10]):
-                self.api.update_status(f"  NEW: {os.path.basename(photo_path)}")
-            if len(new_photos_list) > 10:
-                self.api.update_status(f"  ... and {len(new_photos_list) - 10} more")
+        data = item['data']
+        try:
+            # The file stays in the item in case the faces found call for a larger decode
+            preview = extract_preview(data)
+            item['preview'] = preview is not None
+            if preview is not None:
+                item['image'], item['scale'] = preview
+            else:
+                item['image'], item['scale'] = decode_image(data)
+        except Exception as e:
+            del item['data']
+            item['status'] = 'error'
+            item['error'] = f"Cannot read image: {str(e)}"
+        return item
+    
+    def detect_stage(self, item: dict) -> Optional[dict]:
+        if item['status'] != 'pending':
+            return item
         
-        if len(pending_paths) > 0:
-            self.api.update_status(f"Incomplete photos to retry: {len(pending_paths)} files")
-            pending_list = sorted(list(pending_paths))
-            for i, photo_path in enumerate(pending_list[:10]):
-                self.api.update_status(f"  RETRY: {os.path.basename(photo_path)}")
-            if len(pending_list) > 10:
-                self.api.update_status(f"  ... and {len(pending_list) - 10} more")
+        image = item.pop('image')
+        face_app = self.get_detector()
+        if face_app is None:
+            return None
         
-        self.api.update_status(f"Starting scan of {total} photos in batches of {self.batch_size}...")
+        try:
+            with self.governor.slot():
+                item['faces'], stats = analyze_image(
+                    face_app, image, item.pop('scale'), item.pop('data'), self.cascade, item.pop('preview')
+                )
+            item['status'] = 'completed'
+            self.record_cascade_stats(stats, item['faces'])
+        except Exception as e:
+            item['status'] = 'error'
+            item['error'] = f"Exception processing: {str(e)}"
+        return item
+    
+    def pool_detect_stage(self, item: dict) -> Optional[dict]:
+        if item['status'] != 'pending':
+            return item
         
-        for batch_start in range(0, total, self.batch_size):
-            batch_end = min(batch_start + self.batch_size, total)
-            batch = photos_to_scan[batch_start:batch_end]
-            
-            self.process_batch(batch, scanned_count + batch_start, total_photos, new_photos)
-            
-            should_throttle = self.api.get_dynamic_resources() and not self.api.is_window_foreground()
-            if should_throttle:
-                time.sleep(0.5)
+        pool = self.get_detector()
+        if pool is None:
+            return None
         
-        self.api.scan_complete()
+        try:
+            with self.governor.slot():
+                item.update(pool.analyze(item.pop('data'), self.cascade))
+            if 'cascade' in item:
+                self.record_cascade_stats(item.pop('cascade'), item['faces'])
+        except Exception as e:
+            item['status'] = 'error'
+            item['error'] = f"Exception processing: {str(e)}"
+        return item
     
-    def process_batch(self, batch: List[str], start_idx: int, total_photos: int, new_photos: set):
-        batch_data = []
+    def embed_stage(self, items: List[dict]) -> List[dict]:
+        """Runs recognition once for the face crops of a whole batch of photos"""
+        pending = [item for item in items if item['status'] == 'completed' and item['faces']]
+        if not pending:
+            return items
         
-        for idx, file_path in enumerate(batch):
-            current_overall = start_idx + idx + 1
-            self.api.update_progress(current_overall, total_photos)
-            
-            is_new = file_path in new_photos
-            status_prefix = "NEW" if is_new else "RETRY"
-            
-            if (idx + 1) % 5 == 0 or idx == 0 or (idx + 1) == len(batch):
-                self.api.update_status(f"Scanning {status_prefix}: {os.path.basename(file_path)} (batch {idx + 1}/{len(batch)})")
-            
-            photo_data = self.process_photo_no_commit(file_path)
-            if photo_data:
-                batch_data.append(photo_data)
+        detector = self.get_detector()
+        if detector is None:
+            return [item for item in items if item['status'] != 'completed' or not item['faces']]
+        
+        if self.num_workers > 1:
+            embed = detector.embed
+        else:
+            embed = lambda crops: embed_crops(detector, crops)
         
-        if batch_data:
-            self.commit_batch(batch_data)
-    
-    def process_photo_no_commit(self, file_path: str) -> Optional[dict]:
         try:
-            if not os.path.exists(file_path):
-                self.api.update_status(f"ERROR: File not found - {os.path.basename(file_path)}")
-                return {'file_path': file_path, 'status': 'error', 'faces': []}
-            
-            with open(file_path, 'rb') as f:
-                file_hash = hashlib.md5(f.read()).hexdigest()
-            
-            photo_id = self.db.add_photo(file_path, file_hash)
-            
-            if not photo_id:
-                self.api.update_status(f"ERROR: Failed to add photo to database - {os.path.basename(file_path)}")
-                return None
-            
-            status_row = self.db.conn.execute(
-                'SELECT scan_status FROM photos WHERE photo_id = ?', 
-                (photo_id,)
-            ).fetchone()
-            
-            if not status_row:
-                self.api.update_status(f"ERROR: Photo record not found - {os.path.basename(file_path)}")
-                return None
-            
-            existing_status = status_row[0]
-            
-            if existing_status == 'completed':
-                return None
-            
-            image = self.load_image(file_path)
-            if image is None:
-                self.api.update_status(f"ERROR: Cannot read image - {os.path.basename(file_path)}")
-                return {'file_path': file_path, 'photo_id': photo_id, 'status': 'error', 'faces': []}
-            
-            faces = self.face_app.get(image)
-            
-            if len(faces) == 0:
-                self.api.update_status(f"INFO: No faces detected - {os.path.basename(file_path)}")
+            with self.governor.slot():
+                embed_faces([face for item in pending for face in item['faces']], embed)
+        except Exception as e:
+            for item in pending:
+                item['status'] = 'error'
+                item['faces'] = []
+                item['error'] = f"Exception embedding faces: {str(e)}"
+        return items
+    
+    def record_cascade_stats(self, stats: dict, faces: List[dict]):
+        with self._stats_lock:
+            totals = self.cascade_stats
+            totals['photos'] += 1
+            totals['prefilter_ms'] += stats['prefilter_ms']
+            if stats['skipped']:
+                totals['skipped'] += 1
+            if stats['audited']:
+                totals['audited'] += 1
+                totals['audit_hits'] += 1 if faces else 0
+            elif faces:
+                totals['with_faces'] += 1
+            if not stats['skipped'] or stats['audited']:
+                totals['full_count'] += 1
+                totals['full_ms'] += stats['full_ms']
+    
+    def report_cascade_stats(self):
+        """Throughput and estimated recall of the cascade, to weigh it against full detection"""
+        totals = self.cascade_stats
+        if not self.cascade or totals['photos'] == 0:
+            return
+        
+        skipped_percent = totals['skipped'] / totals['photos'] * 100
+        self.api.update_status(
+            f"Cascade detection: skipped {totals['skipped']} of {totals['photos']} photos as faceless ({skipped_percent:.0f}%)"
+        )
+        
+        if totals['audited'] > 0:
+            hit_rate = totals['audit_hits'] / totals['audited']
+            missed = (totals['skipped'] - totals['audited']) * hit_rate
+            found = totals['with_faces'] + totals['audit_hits']
+            recall = found / (found + missed) * 100 if found + missed > 0 else 100.0
+            self.api.update_status(
+                f"Cascade audit: {totals['audit_hits']} of {totals['audited']} sampled skips had faces, "
+                f"estimated recall of photos with faces {recall:.1f}%"
+            )
+        else:
+            self.api.update_status("Cascade audit: no skipped photos were sampled yet, recall not estimated")
+        
+        prefilter_ms = totals['prefilter_ms'] / totals['photos']
+        full_ms = totals['full_ms'] / totals['full_count'] if totals['full_count'] else 0.0
+        self.api.update_status(
+            f"Average detection time: prefilter {prefilter_ms:.0f} ms per photo, full pass {full_ms:.0f} ms per photo"
+        )
+    
+    def write_stage(self, item: dict):
+        file_path = item['file_path']
+        file_name = os.path.basename(file_path)
+        
+        self.written_count += 1
+        total = sum(self.scan_counts.values())
+        self.api.update_progress(self.written_count, total)
+        
+        if self.written_count % 5 == 0:
+            self.api.update_status(f"Scanning {item['kind'].upper()}: {file_name} ({self.written_count}/{total})")
+        
+        error_count = 0
+        if item['status'] == 'error':
+            error_count = self.get_previous_failures(file_path, item['fingerprint']) + 1
+            if error_count >= MAX_SCAN_FAILURES:
+                item['status'] = 'quarantined'
+                self.api.update_status(f"ERROR: {item['error']} - {file_name} (failed {error_count} times, quarantined)")
             else:
-                self.api.update_status(f"INFO: Found {len(faces)} face(s) - {os.path.basename(file_path)}")
-            
-            face_data = []
-            for face in faces:
-                embedding = face.embedding
-                embedding_norm = embedding / np.linalg.norm(embedding)
-                bbox = face.bbox.tolist()
-                face_data.append({'embedding': embedding_norm, 'bbox': bbox})
-            
-            return {
-                'file_path': file_path,
-                'photo_id': photo_id,
-                'status': 'completed',
-                'faces': face_data
-            }
+                self.api.update_status(f"ERROR: {item['error']} - {file_name}")
+        elif item['status'] == 'duplicate':
+            item['status'] = 'completed'
+            self.duplicate_count += 1
+            self.api.update_status(f"INFO: Duplicate photo, reused {len(item['faces'])} face(s) - {file_name}")
+        elif len(item['faces']) == 0:
+            self.api.update_status(f"INFO: No faces detected - {file_name}")
+        else:
+            self.api.update_status(f"INFO: Found {len(item['faces'])} face(s) - {file_name}")
+        
+        # A modified photo loses its old faces in the same transaction that writes the new ones
+        self.pending_batch.append({
+            'file_path': file_path,
+            'file_hash': item['file_hash'],
+            'fingerprint': item['fingerprint'],
+            'reset_photo_id': item['reset_photo_id'],
+            'status': item['status'],
+            'faces': item['faces'],
+            'error_count': error_count
+        })
+        
+        if len(self.pending_batch) >= self.batch_size:
+            self.write_scan_journal()
+            self.commit_batch(self.pending_batch)
+            self.pending_batch = []
+            self.batches_committed += 1
             
-        except Exception as e:
-            self.api.update_status(f"ERROR: Exception processing {os.path.basename(file_path)}: {str(e)}")
-            return {'file_path': file_path, 'photo_id': photo_id if 'photo_id' in locals() else None, 'status': 'error', 'faces': []}
+            if self.batches_committed % 20 == 0:
+                depths = ', '.join(f"{name} {depth}" for name, depth in self.get_queue_depths().items())
+                self.api.update_status(f"Pipeline queue depths: {depths}")
+        
+        return None
+    
+    def get_previous_failures(self, file_path: str, fingerprint: tuple) -> int:
+        """Failures of the same file content so far, a file that changed starts over"""
+        row = self.known_photos.get(file_path)
+        if row is None or not row['error_count']:
+            return 0
+        if (row['file_size'], row['file_mtime_ns']) != tuple(fingerprint[:2]):
+            return 0
+        return row['error_count']
+    
+    def write_scan_journal(self):
+        """Runs in the writer, photos committed before the journal existed are recorded as done"""
+        with self._journal_lock:
+            journal, self.journal_pending = self.journal_pending, None
+        if journal is None:
+            return
+        
+        self.db.save_scan_journal(
+            self.run_id, journal['items'], journal['moves'], self.committed_paths,
+            journal['directories'], journal['rules']
+        )
     
     def commit_batch(self, batch_data: List[dict]):
         try:
-            cursor = self.db.conn.cursor()
+            photo_ids = self.db.commit_scan_batch(batch_data, self.run_id)
+            self.committed_paths.update(photo_data['file_path'] for photo_data in batch_data)
             
+            # Only committed photos become clone sources, so their faces are readable
             for photo_data in batch_data:
-                photo_id = photo_data['photo_id']
-                
-                for face_data in photo_data['faces']:
-                    face_id = self.db.add_face(photo_id, face_data['embedding'], face_data['bbox'])
-                
-                self.db.update_photo_status(photo_id, photo_data['status'])
-            
-            self.db.conn.commit()
+                if photo_data['status'] == 'completed' and photo_data.get('file_hash'):
+                    self.hash_index.setdefault(photo_data['file_hash'], photo_ids[photo_data['file_path']])
             
         except Exception as e:
             self.api.update_status(f"ERROR: Batch commit failed: {str(e)}")
-            self.db.conn.rollback()
             
+            # Record the photos without faces so they are retried on the next scan. A database
+            # failure is not the file's fault, so it does not count towards quarantine
             for photo_data in batch_data:
-                if photo_data.get('photo_id'):
-                    try:
-                        self.db.update_photo_status(photo_data['photo_id'], 'error')
-                        self.db.conn.commit()
-                    except:
-                        pass
+                photo_data['status'] = 'error'
+                photo_data['faces'] = []
+                photo_data['error_count'] = self.get_previous_failures(
+                    photo_data['file_path'], photo_data['fingerprint']
+                )
+            try:
+                self.db.commit_scan_batch(batch_data, self.run_id)
+                self.committed_paths.update(photo_data['file_path'] for photo_data in batch_data)
+            except Exception:
+                pass
 
 
 class ClusterWorker(threading.Thread):
@@ -317,16 +883,24 @@ class ClusterWorker(threading.Thread):
         self.daemon = True
         self.min_edge_weight = self.threshold + 0.05
         self.max_iterations = 25
+        config = api.get_cluster_config()
+        self.max_neighbors = config['max_neighbors']
+        self.graph_mode = config['graph_mode']
+        self.ann_probes = config['ann_probes']
     
     def run(self):
         try:
-            self.api.update_status("Loading embeddings...")
-            face_ids, embeddings = self.db.get_all_embeddings()
+            precision = self.api.get_embedding_precision()
+            self.api.update_status(f"Loading embeddings ({precision})...")
+            face_ids, embeddings = self.db.get_all_embeddings(precision)
             
             if len(embeddings) == 0:
                 self.api.update_status("No faces found")
                 return
             
+            if precision != 'float32':
+                self.report_precision(precision)
+            
             old_clustering = self.db.get_active_clustering()
             old_clustering_id = old_clustering['clustering_id'] if old_clustering else None
             
@@ -346,7 +920,7 @@ class ClusterWorker(threading.Thread):
             
             self.api.update_status(f"Clustering {len(embeddings)} faces with Chinese Whispers...")
             
-            person_ids, confidences, embeddings_norm = self.cluster_with_pytorch(embeddings)
+            person_ids, confidences = self.cluster_with_pytorch(embeddings, face_ids)
             
             self.api.update_status("Merging clusters by existing tags...")
             person_ids = self.merge_by_tags(face_ids, person_ids)
@@ -375,6 +949,8 @@ class ClusterWorker(threading.Thread):
             
         except Exception as e:
             self.api.update_status(f"Error: {str(e)}")
+        finally:
+            self.api.clustering_finished()
     
     def restore_hidden_persons(self, clustering_id: int, face_ids: List[int], person_ids: List[int], hidden_face_ids: set):
         new_person_ids_to_hide = set()
@@ -392,81 +968,82 @@ class ClusterWorker(threading.Thread):
         
         self.api.update_status(f"Hidden {len(new_person_ids_to_hide)} persons after reclustering")
     
-    def cluster_with_pytorch(self, embeddings: np.ndarray) -> Tuple[List[int], List[float], torch.Tensor]:
+    def report_precision(self, precision: str):
+        """Measures on a sample how far similarities in the storage precision are from float32"""
+        sample = self.db.sample_embeddings(PRECISION_SAMPLE)
+        if len(sample) < 2:
+            return
+        report = measure_precision(sample, precision, self.min_edge_weight)
+        self.api.update_status(format_precision_report(report))
+    
+    def use_ann_index(self, n_faces: int) -> bool:
+        if self.graph_mode != 'auto':
+            return self.graph_mode == 'ann'
+        return n_faces >= (ANN_MIN_FACES_GPU if GPU_AVAILABLE else ANN_MIN_FACES_CPU)
+    
+    def cluster_with_pytorch(self, embeddings: EmbeddingMatrix, face_ids: List[int]) -> Tuple[List[int], List[float]]:
         n_faces = len(embeddings)
         
         device_name = "GPU" if GPU_AVAILABLE else "CPU"
         self.api.update_status(f"Using {device_name} for clustering...")
         
-        embeddings_tensor = torch.tensor(embeddings, dtype=torch.float32).to(DEVICE)
+        # Shares memory with the mapped embedding store on CPU instead of copying it; rows
+        # of deleted faces are skipped through the live row index rather than copied out
+        values = torch.from_numpy(np.asarray(embeddings.values)).to(DEVICE)
+        live_rows = torch.from_numpy(embeddings.rows).to(DEVICE) if embeddings.rows is not None else None
         
-        self.api.update_status("Normalizing embeddings...")
-        embeddings_norm = embeddings_tensor / embeddings_tensor.norm(dim=1, keepdim=True)
+        def stored_rows(rows) -> torch.Tensor:
+            return values[rows] if live_rows is None else values[live_rows[rows]]
         
-        batch_size = 1000
-        n_batches = (n_faces + batch_size - 1) // batch_size
+        # The int8 row scale cancels out once rows are normalized, so every precision only
+        # needs the inverse norm of its stored rows
+        self.api.update_status("Normalizing embeddings...")
+        inverse_norms = torch.empty(n_faces, dtype=torch.float32, device=DEVICE)
+        for start in range(0, n_faces, SIMILARITY_CHUNK):
+            chunk = slice(start, start + SIMILARITY_CHUNK)
+            inverse_norms[chunk] = 1.0 / stored_rows(chunk).float().norm(dim=1)
         
-        self.api.update_status("Building similarity graph...")
+        def unit_rows(rows) -> torch.Tensor:
+            return stored_rows(rows).float() * inverse_norms[rows].unsqueeze(1)
         
-        adjacency = {}
-        edge_count = 0
+        if self.use_ann_index(n_faces):
+            edge_rows, edge_cols, edge_weights = self.find_edges_ann(unit_rows, embeddings, face_ids)
+            max_neighbors = self.max_neighbors or ANN_DEFAULT_NEIGHBORS
+        else:
+            edge_rows, edge_cols, edge_weights = self.find_edges_exact(unit_rows, n_faces)
+            max_neighbors = self.max_neighbors
         
-        for i in range(n_batches):
-            start_i = i * batch_size
-            end_i = min((i + 1) * batch_size, n_faces)
-            batch_i = embeddings_norm[start_i:end_i]
-            
-            similarities = torch.mm(batch_i, embeddings_norm.T)
-            similarities_cpu = similarities.cpu().numpy()
-            
-            for local_idx, global_idx in enumerate(range(start_i, end_i)):
-                similar_indices = np.where(similarities_cpu[local_idx] >= self.min_edge_weight)[0]
-                
-                neighbors = {}
-                for j in similar_indices:
-                    if global_idx != j:
-                        weight = float(similarities_cpu[local_idx, j])
-                        neighbors[int(j)] = weight
-                        edge_count += 1
-                
-                if neighbors:
-                    adjacency[global_idx] = neighbors
-            
-            if (i + 1) % 10 == 0 or i == n_batches - 1:
-                self.api.update_status(f"Graph building: batch {i+1}/{n_batches}")
+        graph = SimilarityGraph.from_pairs(n_faces, edge_rows, edge_cols, edge_weights, max_neighbors)
+        del edge_rows, edge_cols, edge_weights
         
-        self.api.update_status(f"Graph built: {len(adjacency)} nodes, {edge_count} edges")
+        self.api.update_status(f"Graph built: {graph.connected_count} nodes, {graph.edge_count} edges")
         
         labels = list(range(n_faces))
+        indptr = graph.indptr.tolist()
+        neighbor_indices = graph.indices.tolist()
+        neighbor_weights = graph.weights.tolist()
+        connected_nodes = [node for node in range(n_faces) if indptr[node] != indptr[node + 1]]
         
         self.api.update_status("Running Chinese Whispers clustering...")
         
         for iteration in range(self.max_iterations):
             changes = 0
-            node_order = list(range(n_faces))
+            node_order = connected_nodes[:]
             random.shuffle(node_order)
             
             for node in node_order:
-                if node not in adjacency:
-                    continue
-                
-                neighbors = adjacency[node]
-                if not neighbors:
-                    continue
-                
                 label_weights = {}
-                for neighbor, weight in neighbors.items():
-                    neighbor_label = labels[neighbor]
-                    label_weights[neighbor_label] = label_weights.get(neighbor_label, 0) + weight
+                for k in range(indptr[node], indptr[node + 1]):
+                    neighbor_label = labels[neighbor_indices[k]]
+                    label_weights[neighbor_label] = label_weights.get(neighbor_label, 0) + neighbor_weights[k]
                 
-                if label_weights:
-                    best_label = max(label_weights.items(), key=lambda x: x[1])[0]
-                    
-                    if labels[node] != best_label:
-                        labels[node] = best_label
-                        changes += 1
+                best_label = max(label_weights.items(), key=lambda x: x[1])[0]
+                
+                if labels[node] != best_label:
+                    labels[node] = best_label
+                    changes += 1
             
-            if (i + 1) % 5 == 0 or i == n_batches - 1:
+            if (iteration + 1) % 5 == 0 or iteration == self.max_iterations - 1:
                 self.api.update_status(f"Iteration {iteration+1}/{self.max_iterations}: {changes} changes")
             
             if changes < n_faces * 0.001:
@@ -482,15 +1059,19 @@ class ClusterWorker(threading.Thread):
         confidences = [0.0] * n_faces
         rejected = 0
         
+        members = {}
+        for i, label in enumerate(labels):
+            members.setdefault(label, []).append(i)
+        
         for old_label in unique_labels:
-            cluster_indices = [i for i, l in enumerate(labels) if l == old_label]
+            cluster_indices = members[old_label]
             
             if len(cluster_indices) == 1:
                 person_ids[cluster_indices[0]] = 0
                 confidences[cluster_indices[0]] = 0.0
                 continue
             
-            cluster_embeddings = embeddings_norm[cluster_indices]
+            cluster_embeddings = unit_rows(torch.tensor(cluster_indices, device=DEVICE))
             centroid = cluster_embeddings.mean(dim=0)
             centroid = centroid / centroid.norm()
             
@@ -511,7 +1092,98 @@ class ClusterWorker(threading.Thread):
         
         self.api.update_status(f"Validation complete: {rejected} faces rejected")
         
-        return person_ids, confidences, embeddings_norm
+        return person_ids, confidences
+    
+    def find_edges_exact(self, unit_rows, n_faces: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        batch_size = 1000
+        n_batches = (n_faces + batch_size - 1) // batch_size
+        
+        self.api.update_status("Building similarity graph...")
+        
+        # Similarity is symmetric, so each row block is only compared with itself and the
+        # columns after it, and edges are picked out of the block on the device
+        edge_rows, edge_cols, edge_weights = [], [], []
+        
+        for i in range(n_batches):
+            start_i = i * batch_size
+            end_i = min((i + 1) * batch_size, n_faces)
+            batch_i = unit_rows(slice(start_i, end_i))
+            
+            for start_j in range(start_i, n_faces, SIMILARITY_CHUNK):
+                end_j = min(start_j + SIMILARITY_CHUNK, n_faces)
+                similarities = torch.mm(batch_i, unit_rows(slice(start_j, end_j)).T)
+                
+                mask = similarities >= self.min_edge_weight
+                if start_j == start_i:
+                    mask = torch.triu(mask, diagonal=1)
+                rows, cols = torch.nonzero(mask, as_tuple=True)
+                
+                edge_rows.append((rows + start_i).cpu().numpy())
+                edge_cols.append((cols + start_j).cpu().numpy())
+                edge_weights.append(similarities[rows, cols].cpu().numpy())
+            
+            if (i + 1) % 10 == 0 or i == n_batches - 1:
+                self.api.update_status(f"Graph building: batch {i+1}/{n_batches}")
+        
+        return np.concatenate(edge_rows), np.concatenate(edge_cols), np.concatenate(edge_weights)
+    
+    def find_edges_ann(self, unit_rows, embeddings: EmbeddingMatrix, face_ids: List[int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Each face's strongest neighbors above min_edge_weight, searched only in the
+        lists of the IVF index nearest to its own"""
+        n_faces = len(embeddings)
+        index = self.db.ann_index
+        
+        self.api.update_status("Updating nearest-neighbor index...")
+        list_ids, trained = index.update(np.asarray(face_ids), embeddings)
+        n_lists = len(index.centroids)
+        if trained:
+            self.api.update_status(f"Trained nearest-neighbor index with {n_lists} lists")
+        
+        probes = index.probe_lists(self.ann_probes)
+        members_order = np.argsort(list_ids, kind='stable')
+        list_starts = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(list_ids, minlength=n_lists), out=list_starts[1:])
+        
+        def members(list_id):
+            return members_order[list_starts[list_id]:list_starts[list_id + 1]]
+        
+        self.api.update_status(f"Building similarity graph from {n_lists} lists, {probes.shape[1]} searched per face...")
+        
+        top_k = self.max_neighbors or ANN_DEFAULT_NEIGHBORS
+        edge_rows, edge_cols, edge_weights = [], [], []
+        
+        for list_id in range(n_lists):
+            queries = members(list_id)
+            if len(queries) == 0:
+                continue
+            
+            # The list itself comes first among its probes, so each query's own column is
+            # at the same position as its row
+            candidates = np.concatenate([members(probe) for probe in probes[list_id]])
+            similarities = torch.mm(
+                unit_rows(torch.from_numpy(queries).to(DEVICE)),
+                unit_rows(torch.from_numpy(candidates).to(DEVICE)).T
+            )
+            similarities.fill_diagonal_(-1.0)
+            
+            weights, positions = torch.topk(similarities, min(top_k, len(candidates)), dim=1)
+            rows, ranks = torch.nonzero(weights >= self.min_edge_weight, as_tuple=True)
+            rows = rows.cpu().numpy()
+            
+            edge_rows.append(queries[rows])
+            edge_cols.append(candidates[positions[rows, ranks].cpu().numpy()])
+            edge_weights.append(weights[rows, ranks].cpu().numpy())
+            
+            if (list_id + 1) % 500 == 0 or list_id == n_lists - 1:
+                self.api.update_status(f"Graph building: list {list_id+1}/{n_lists}")
+        
+        # A pair is usually found from both ends, keep it once with the lower index first
+        rows = np.concatenate(edge_rows)
+        cols = np.concatenate(edge_cols)
+        weights = np.concatenate(edge_weights)
+        low, high = np.minimum(rows, cols), np.maximum(rows, cols)
+        _, unique = np.unique(low * n_faces + high, return_index=True)
+        return low[unique], high[unique], weights[unique]
     
     def merge_by_tags(self, face_ids: List[int], person_ids: List[int]) -> List[int]:
         cursor = self.db.conn.cursor()
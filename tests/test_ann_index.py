@@ -0,0 +1,72 @@
+import numpy as np
+import torch
+
+from ann_index import IVFIndex
+from database import FaceDatabase
+from embedding_store import EmbeddingMatrix
+from workers import ClusterWorker
+
+
+class ClusterApi:
+    def __init__(self, ann_probes=8):
+        self.ann_probes = ann_probes
+        self.messages = []
+
+    def update_status(self, message):
+        self.messages.append(message)
+
+    def get_cluster_config(self):
+        return {'max_neighbors': 0, 'graph_mode': 'ann', 'ann_probes': self.ann_probes}
+
+
+def clustered_embeddings(n_people, faces_per_person, dim=64, seed=0):
+    """Faces of one person lie close together, different people are nearly orthogonal"""
+    rng = np.random.default_rng(seed)
+    people = rng.standard_normal((n_people, dim))
+    people /= np.linalg.norm(people, axis=1, keepdims=True)
+    faces = np.repeat(people, faces_per_person, axis=0) + 0.06 * rng.standard_normal((n_people * faces_per_person, dim))
+    return faces.astype(np.float32)
+
+
+def edge_dict(rows, cols, weights):
+    return {(int(row), int(col)): float(weight) for row, col, weight in zip(rows, cols, weights)}
+
+
+def test_ann_edges_match_exact_edges_on_separated_people(tmp_path):
+    # 8 faces a person, so even a person split over 8 lists is fully searched with 8 probes
+    embeddings = clustered_embeddings(n_people=30, faces_per_person=8)
+    face_ids = list(range(1, len(embeddings) + 1))
+    values = torch.from_numpy(embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True))
+
+    def unit_rows(rows):
+        return values[rows]
+
+    worker = ClusterWorker(FaceDatabase(str(tmp_path / "db")), 50, ClusterApi())
+    exact = edge_dict(*worker.find_edges_exact(unit_rows, len(embeddings)))
+    approximate = edge_dict(*worker.find_edges_ann(unit_rows, EmbeddingMatrix(embeddings), face_ids))
+
+    assert len(exact) == 30 * 8 * 7 // 2
+    assert approximate.keys() == exact.keys()
+    for pair, weight in exact.items():
+        assert abs(approximate[pair] - weight) < 1e-5
+
+
+def test_ann_index_keeps_lists_of_known_faces(tmp_path):
+    embeddings = clustered_embeddings(n_people=20, faces_per_person=10)
+    index = IVFIndex(str(tmp_path / "ann_index"))
+    first_lists, trained = index.update(np.arange(1, 151), EmbeddingMatrix(embeddings[:150]))
+    assert trained
+
+    # Reopened from disk with face 1 deleted and 50 new faces, the deleted row skipped by index
+    live = np.ones(len(embeddings), dtype=bool)
+    live[0] = False
+    reopened = IVFIndex(str(tmp_path / "ann_index"))
+    second_lists, trained = reopened.update(np.arange(2, 201), EmbeddingMatrix(embeddings).select(live))
+
+    assert not trained
+    np.testing.assert_array_equal(second_lists[:149], first_lists[1:])
+    expected_new = IVFIndex._nearest(
+        embeddings[150:] / np.linalg.norm(embeddings[150:], axis=1, keepdims=True), reopened.centroids
+    )
+    np.testing.assert_array_equal(second_lists[149:], expected_new)
+    assert reopened.face_ids.tolist() == list(range(2, 201))
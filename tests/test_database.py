@@ -0,0 +1,95 @@
+import pickle
+
+import lmdb
+import numpy as np
+
+import database
+from database import FaceDatabase
+
+
+def scanned_photo(path, embeddings, reset_photo_id=None):
+    return {
+        'file_path': path,
+        'file_hash': f"hash of {path}",
+        'fingerprint': (100, 1, 1),
+        'status': 'completed',
+        'faces': [{'bbox': [0, 0, 10, 10], 'embedding': embedding} for embedding in embeddings],
+        'error_count': 0,
+        'reset_photo_id': reset_photo_id
+    }
+
+
+def face_ids_by_photo(db):
+    rows = db.conn.execute('SELECT photo_id, face_id FROM faces ORDER BY face_id').fetchall()
+    faces = {}
+    for photo_id, face_id in rows:
+        faces.setdefault(photo_id, []).append(face_id)
+    return faces
+
+
+def test_scan_batch_allocates_face_ids_after_deleted_ones(tmp_path):
+    db = FaceDatabase(str(tmp_path / "db"))
+    embeddings = np.random.default_rng(0).standard_normal((6, 8)).astype(np.float32)
+
+    statements = []
+    db.conn.set_trace_callback(statements.append)
+    photo_ids = db.commit_scan_batch([
+        scanned_photo('/photos/a.jpg', embeddings[:2]),
+        scanned_photo('/photos/b.jpg', embeddings[2:3])
+    ])
+    db.conn.set_trace_callback(None)
+
+    assert statements.count('COMMIT') == 1
+    a, b = photo_ids['/photos/a.jpg'], photo_ids['/photos/b.jpg']
+    assert face_ids_by_photo(db) == {a: [1, 2], b: [3]}
+
+    # Rescanning b drops its face, the newest id, which is still never handed out again
+    db.commit_scan_batch([
+        scanned_photo('/photos/b.jpg', embeddings[3:5], reset_photo_id=b),
+        scanned_photo('/photos/c.jpg', embeddings[5:])
+    ])
+    c = db.get_photo_id('/photos/c.jpg')
+    assert face_ids_by_photo(db) == {a: [1, 2], b: [4, 5], c: [6]}
+
+    assert db.get_face_embedding(3) is None
+    for face_id, row in zip([1, 2, 4, 5, 6], [0, 1, 3, 4, 5]):
+        np.testing.assert_array_equal(db.get_face_embedding(face_id), embeddings[row])
+
+    face_ids, matrix = db.get_all_embeddings('float32')
+    assert list(face_ids) == [1, 2, 4, 5, 6]
+    np.testing.assert_array_equal(np.asarray(matrix.gather(np.arange(len(matrix)))[0]), embeddings[[0, 1, 3, 4, 5]])
+    db.close()
+
+
+def test_pickled_embeddings_are_migrated_to_binary_keys(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(database, 'MIGRATION_CHUNK', 4)
+    embeddings = np.random.default_rng(0).standard_normal((11, 8))
+
+    # The layout of older versions: pickled float64 arrays under decimal keys in the main database
+    folder = tmp_path / "db"
+    folder.mkdir()
+    env = lmdb.open(str(folder / "encodings.lmdb"), map_size=64 * 1024 * 1024, max_dbs=4)
+    with env.begin(write=True) as txn:
+        for face_id, embedding in enumerate(embeddings, start=1):
+            txn.put(str(face_id).encode(), pickle.dumps(embedding))
+    env.close()
+
+    db = FaceDatabase(str(folder))
+    assert "Migration complete: 11 embeddings converted" in capsys.readouterr().out
+    with db.env.begin() as txn:
+        assert [key for key, _ in txn.cursor()] == [database.EMBEDDINGS_DB_NAME]
+    with db.env.begin(db=db.embeddings_db) as txn:
+        keys = [key for key, _ in txn.cursor()]
+    assert keys == [database._embedding_key(face_id) for face_id in range(1, 12)]
+
+    for face_id, embedding in enumerate(embeddings, start=1):
+        stored = db.get_face_embedding(face_id)
+        assert stored.dtype == np.float32
+        np.testing.assert_array_equal(stored, embedding.astype(np.float32))
+    db.close()
+
+    # Nothing is left to migrate on the next start
+    reopened = FaceDatabase(str(folder))
+    assert "Migrating" not in capsys.readouterr().out
+    np.testing.assert_array_equal(reopened.get_face_embedding(11), embeddings[10].astype(np.float32))
+    reopened.close()
@@ -0,0 +1,47 @@
+import numpy as np
+
+from embedding_store import EmbeddingStore
+
+
+def test_removing_newest_face_keeps_store_matching(tmp_path):
+    store = EmbeddingStore(str(tmp_path))
+    embeddings = np.random.default_rng(0).standard_normal((3, 8)).astype(np.float32)
+    store.append([1, 2, 3], embeddings)
+
+    store.remove([3])
+
+    assert store.max_face_id == 2
+    assert store.matches(2, 2, 'float32')
+    face_ids, matrix = store.load()
+    assert face_ids.tolist() == [1, 2]
+    np.testing.assert_array_equal(np.asarray(matrix.values), embeddings[:2])
+
+
+def test_removing_older_face_keeps_newest_id(tmp_path):
+    store = EmbeddingStore(str(tmp_path))
+    store.append([1, 2, 3], np.ones((3, 8), dtype=np.float32))
+
+    store.remove([1])
+
+    assert store.max_face_id == 3
+    assert store.matches(2, 3, 'float32')
+
+
+def test_load_skips_deleted_rows_without_copying(tmp_path):
+    store = EmbeddingStore(str(tmp_path))
+    embeddings = np.random.default_rng(1).standard_normal((20, 8)).astype(np.float32)
+    store.append(list(range(1, 21)), embeddings)
+
+    # One tombstone in 20 rows stays below the compaction ratio
+    store.remove([5])
+    face_ids, matrix = store.load()
+
+    assert face_ids.tolist() == [face_id for face_id in range(1, 21) if face_id != 5]
+    assert len(matrix) == 19
+    assert isinstance(matrix.values, np.memmap) and len(matrix.values) == 20
+    values, scales = matrix.gather(np.arange(len(matrix)))
+    assert scales is None
+    np.testing.assert_array_equal(values, np.delete(embeddings, 4, axis=0))
+
+    selected = matrix.select(face_ids % 2 == 0)
+    np.testing.assert_array_equal(selected.gather(slice(None))[0], embeddings[1::2])
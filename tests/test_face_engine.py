@@ -0,0 +1,92 @@
+from io import BytesIO
+
+import pytest
+
+pillow_heif = pytest.importorskip('pillow_heif')
+import numpy as np
+from PIL import Image
+
+from face_engine import analyze_image, decode_image, extract_preview, needs_tiling
+
+
+def _heic_bytes(size, thumbnails):
+    image = Image.new('RGB', size, (120, 30, 200))
+    buffer = BytesIO()
+    pillow_heif.from_pillow(image).save(buffer, quality=50, thumbnails=thumbnails)
+    return buffer.getvalue()
+
+
+def test_heic_preview_uses_smallest_adequate_thumbnail():
+    data = _heic_bytes((2000, 1500), [256, 800, 1000])
+
+    preview = extract_preview(data, min_side=640)
+
+    assert preview is not None
+    image, scale = preview
+    assert image.shape[:2] == (600, 800)
+    assert scale == pytest.approx(0.4)
+
+
+def test_heic_without_adequate_thumbnail_falls_back():
+    data = _heic_bytes((2000, 1500), [256])
+
+    assert extract_preview(data, min_side=640) is None
+
+
+def test_phone_photos_are_not_tiled_but_panoramas_are():
+    assert not needs_tiling(8000, 6000)
+    assert not needs_tiling(6000, 8000)
+    assert needs_tiling(12000, 3000)
+
+
+class FakeDetModel:
+    """Reports one square face of face_side pixels in each image it is given"""
+
+    def __init__(self, face_side):
+        self.face_side = face_side
+        self.calls = []
+
+    def detect(self, image, **kwargs):
+        self.calls.append(image.shape[:2])
+        side = self.face_side * max(image.shape[:2]) / 1280
+        bbox = np.array([[10, 10, 10 + side, 10 + side, 0.9]], dtype=np.float32)
+        kps = np.array([[[10 + side * x, 10 + side * y] for x, y in
+                         ((0.3, 0.4), (0.7, 0.4), (0.5, 0.6), (0.35, 0.8), (0.65, 0.8))]], dtype=np.float32)
+        return bbox, kps
+
+    def nms(self, bboxes):
+        return [0]
+
+
+class FakeRecognition:
+    input_size = (112, 112)
+
+
+class FakeFaceApp:
+    def __init__(self, face_side):
+        self.det_model = FakeDetModel(face_side)
+        self.models = {'recognition': FakeRecognition()}
+
+
+def _jpeg_bytes(size):
+    buffer = BytesIO()
+    Image.new('RGB', size, (90, 90, 90)).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize('face_side, tiled', [(120, False), (8, True)])
+def test_large_photo_is_tiled_only_when_faces_are_near_detector_limit(face_side, tiled):
+    data = _jpeg_bytes((4000, 3000))
+    image, scale = decode_image(data)
+    face_app = FakeFaceApp(face_side)
+
+    faces, _ = analyze_image(face_app, image, scale, data)
+
+    assert len(faces) == 1
+    if tiled:
+        # Whole image pass at reduced size, then the full resolution image and its tiles
+        assert face_app.det_model.calls[0] == image.shape[:2]
+        assert face_app.det_model.calls[1] == (3000, 4000)
+        assert len(face_app.det_model.calls) > 3
+    else:
+        assert face_app.det_model.calls == [image.shape[:2]]
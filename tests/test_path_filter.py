@@ -0,0 +1,66 @@
+import ntpath
+import types
+
+import pytest
+
+import path_filter
+from path_filter import PathFilter
+
+
+@pytest.fixture
+def windows_paths(monkeypatch):
+    """Runs the filter with Windows path rules on any platform"""
+    monkeypatch.setattr(path_filter, 'os', types.SimpleNamespace(sep='\\', path=ntpath))
+
+
+def test_excluded_folder_does_not_exclude_sibling_with_same_prefix(windows_paths):
+    rules = PathFilter(['C:\\'], ['C:\\Photos'], '')
+
+    assert rules.is_excluded('C:\\Photos')
+    assert rules.is_excluded('C:\\photos\\2019\\a.jpg')
+    assert not rules.is_excluded('C:\\Photos2')
+    assert not rules.is_excluded('C:\\Photos2\\a.jpg')
+
+    assert rules.is_child_excluded('C:\\Photos', 'Photos')
+    assert not rules.is_child_excluded('C:\\Photos2', 'Photos2')
+
+
+def test_paths_outside_include_folders_are_excluded(windows_paths):
+    rules = PathFilter(['C:\\Photos'], [], '')
+
+    assert not rules.is_excluded('C:/Photos/a.jpg')
+    assert rules.is_excluded('C:\\Photos2\\a.jpg')
+    assert rules.is_excluded('D:\\Photos\\a.jpg')
+
+
+def test_wildcards_match_whole_path_components(windows_paths):
+    rules = PathFilter(['C:\\Photos'], [], '*.tmp, .thumbnails ,  , C:\\Photos\\Private')
+
+    assert rules.is_excluded('C:\\Photos\\a.TMP')
+    assert rules.is_excluded('C:\\Photos\\.thumbnails\\a.jpg')
+    assert not rules.is_excluded('C:\\Photos\\my.thumbnails\\a.jpg')
+    assert not rules.is_excluded('C:\\Photos\\a.tmp.jpg')
+
+    # Absolute wildcards act as excluded folders
+    assert rules.is_excluded('C:\\Photos\\Private\\a.jpg')
+    assert not rules.is_excluded('C:\\Photos\\Private2\\a.jpg')
+
+    assert rules.is_child_excluded('C:\\Photos\\b.tmp', 'b.tmp')
+    assert rules.is_child_excluded('C:\\Photos\\Private', 'Private')
+    assert not rules.is_child_excluded('C:\\Photos\\b.jpg', 'b.jpg')
+
+
+def test_no_include_folders_excludes_nothing():
+    rules = PathFilter([], ['/photos'], '*.jpg')
+
+    assert not rules.is_excluded('/photos/a.jpg')
+    assert not rules.is_child_excluded('/photos/a.jpg', 'a.jpg')
+
+
+def test_posix_folder_rules_match_whole_components():
+    rules = PathFilter(['/data'], ['/data/photos'], '@eaDir')
+
+    assert rules.is_excluded('/data/photos/a.jpg')
+    assert not rules.is_excluded('/data/photos2/a.jpg')
+    assert rules.is_excluded('/data/photos2/@eaDir/a.jpg')
+    assert rules.is_excluded('/database/a.jpg')
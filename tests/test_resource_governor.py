@@ -0,0 +1,57 @@
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+import resource_governor
+from resource_governor import ResourceGovernor, _LoadSampler
+
+
+def _spin(seconds):
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        pass
+
+
+@pytest.mark.skipif(not os.path.isdir('/proc'), reason="worker processes are read from /proc")
+def test_sampler_without_psutil_counts_worker_processes(monkeypatch):
+    monkeypatch.setattr(resource_governor, 'PSUTIL_AVAILABLE', False)
+    worker = multiprocessing.get_context('spawn').Process(target=_spin, args=(1.5,))
+    worker.start()
+    try:
+        sampler = _LoadSampler()
+        sampler.sample()
+        time.sleep(1.0)
+        _, own = sampler.sample()
+    finally:
+        worker.join()
+
+    # The worker kept one core busy while this process slept
+    assert own > 50 / sampler.cpu_count
+
+
+class IdleApi:
+    def get_dynamic_resources(self):
+        return False
+
+    def is_window_foreground(self):
+        return True
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason="per thread nice values are Linux only")
+def test_in_process_detection_lowers_only_its_thread():
+    governor = ResourceGovernor(IdleApi(), 1, lower_threads=True)
+    priorities = []
+
+    def detect():
+        with governor.slot():
+            priorities.append(os.getpriority(os.PRIO_PROCESS, threading.get_native_id()))
+
+    thread = threading.Thread(target=detect)
+    thread.start()
+    thread.join()
+
+    assert priorities[0] > os.getpriority(os.PRIO_PROCESS, threading.get_native_id())
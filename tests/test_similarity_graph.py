@@ -0,0 +1,52 @@
+import numpy as np
+
+from similarity_graph import SimilarityGraph
+
+
+def edge_set(graph):
+    return {
+        (node, int(neighbor))
+        for node in range(graph.n_nodes)
+        for neighbor in graph.indices[graph.indptr[node]:graph.indptr[node + 1]]
+    }
+
+
+def test_graph_stores_every_edge_in_both_directions():
+    graph = SimilarityGraph.from_pairs(4, [0, 0, 1], [1, 2, 2], [0.9, 0.5, 0.7])
+
+    assert graph.edge_count == 3
+    assert graph.connected_count == 3
+    assert graph.indptr.tolist() == [0, 2, 4, 6, 6]
+    assert graph.indices[graph.indptr[2]:graph.indptr[3]].tolist() == [0, 1]
+    np.testing.assert_allclose(graph.weights[graph.indptr[2]:graph.indptr[3]], [0.5, 0.7])
+
+
+def test_top_k_keeps_edge_when_either_end_keeps_it():
+    rng = np.random.default_rng(0)
+    n_nodes, max_neighbors = 40, 3
+    rows, cols = np.triu_indices(n_nodes, k=1)
+    weights = rng.random(len(rows)).astype(np.float32)
+
+    graph = SimilarityGraph.from_pairs(n_nodes, rows, cols, weights, max_neighbors)
+
+    strongest = set()
+    for node in range(n_nodes):
+        touching = np.nonzero((rows == node) | (cols == node))[0]
+        for pair in touching[np.argsort(-weights[touching])[:max_neighbors]]:
+            strongest.add((int(rows[pair]), int(cols[pair])))
+    expected = strongest | {(col, row) for row, col in strongest}
+
+    edges = edge_set(graph)
+    assert edges == expected
+    assert all((neighbor, node) in edges for node, neighbor in edges)
+    assert graph.edge_count == len(strongest)
+
+    # A node may hold more than k edges through its neighbors, never fewer than k
+    degrees = np.diff(graph.indptr)
+    assert degrees.min() >= max_neighbors
+    for node in range(n_nodes):
+        span = slice(graph.indptr[node], graph.indptr[node + 1])
+        assert np.all(np.diff(graph.indices[span]) > 0)
+        for neighbor, weight in zip(graph.indices[span], graph.weights[span]):
+            pair = np.nonzero((rows == min(node, neighbor)) & (cols == max(node, neighbor)))[0][0]
+            assert weight == weights[pair]
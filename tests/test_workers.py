@@ -0,0 +1,227 @@
+import hashlib
+import os
+import shutil
+
+import numpy as np
+from PIL import Image
+
+import face_engine
+import workers
+from database import FaceDatabase
+from workers import _HeldStatus
+
+
+class RecordingApi:
+    def __init__(self):
+        self.messages = []
+        self.progress = []
+
+    def update_status(self, message):
+        self.messages.append(message)
+
+    def update_progress(self, current, total):
+        self.progress.append((current, total))
+
+    def get_scan_workers(self):
+        return 1
+
+
+def test_held_status_stays_silent_until_released():
+    api = RecordingApi()
+    held = _HeldStatus(api)
+
+    held.update_status("Discovering photos...")
+    held.update_progress(0, 1)
+    assert api.messages == [] and api.progress == []
+    assert held.get_scan_workers() == 1
+
+    held.release()
+    held.update_status("  NEW: a.jpg")
+    held.update_progress(1, 1)
+    assert api.messages == ["Discovering photos...", "  NEW: a.jpg"]
+    assert api.progress == [(1, 1)]
+
+
+class ScanApi(RecordingApi):
+    def __init__(self, folder):
+        super().__init__()
+        self.folder = folder
+        self.completed = 0
+        self.new_photos_found = None
+
+    def get_include_folders(self):
+        return [self.folder]
+
+    def get_exclude_folders(self):
+        return []
+
+    def get_wildcard_exclusions(self):
+        return []
+
+    def get_model_pack(self):
+        return 'buffalo_l'
+
+    def get_scan_pipeline_config(self):
+        return {'io_threads': 1, 'decode_threads': 1, 'queue_size': 4, 'discovery_threads': 1, 'detection_mode': 'full'}
+
+    def get_dynamic_resources(self):
+        return False
+
+    def is_window_foreground(self):
+        return True
+
+    def get_cpu_budget(self):
+        return 100
+
+    def set_new_photos_found(self, found):
+        self.new_photos_found = found
+
+    def set_photos_deleted(self, deleted):
+        pass
+
+    def scan_complete(self, quiet=False):
+        self.completed += 1
+
+
+def test_scan_aborts_when_model_fails_to_load(tmp_path, monkeypatch):
+    def fail_to_load(*args, **kwargs):
+        raise RuntimeError("model files missing")
+
+    monkeypatch.setattr(workers, 'create_face_app', fail_to_load)
+    photos = tmp_path / "photos"
+    photos.mkdir()
+    Image.new('RGB', (64, 64)).save(photos / "a.jpg")
+
+    db = FaceDatabase(str(tmp_path / "db"))
+    api = ScanApi(str(photos))
+    worker = workers.ScanWorker(db, api)
+    worker.run()
+
+    assert "Scan aborted: the face detection model could not be loaded" in api.messages
+    assert not any(message.startswith("Scanned ") for message in api.messages)
+    assert api.completed == 1
+    assert api.new_photos_found is False
+    assert worker.pipeline_thread is None and worker.pool is None
+    assert db.get_total_photos() == 0
+
+
+class PoolScanApi(ScanApi):
+    def get_scan_workers(self):
+        return 2
+
+
+def test_pool_scan_aborts_when_workers_fail_to_load_model(tmp_path, monkeypatch):
+    model_root = tmp_path / "models_root"
+    (model_root / "models" / "buffalo_l").mkdir(parents=True)
+    (model_root / "models" / "buffalo_l" / "det_10g.onnx").write_bytes(b"not a model")
+    monkeypatch.setattr(face_engine, 'get_insightface_root', lambda: str(model_root))
+    photos = tmp_path / "photos"
+    photos.mkdir()
+    Image.new('RGB', (64, 64)).save(photos / "a.jpg")
+
+    db = FaceDatabase(str(tmp_path / "db"))
+    api = PoolScanApi(str(photos))
+    worker = workers.ScanWorker(db, api)
+    worker.run()
+
+    assert any(message.startswith("Error loading model: ") for message in api.messages)
+    assert "Scan aborted: the face detection model could not be loaded" in api.messages
+    assert api.completed == 1
+    assert worker.pool is None
+    assert db.get_total_photos() == 0
+
+
+class FakeDetector:
+    def detect(self, image, **kwargs):
+        return np.zeros((0, 5), dtype=np.float32), np.zeros((0, 5, 2), dtype=np.float32)
+
+
+class FakeFaceApp:
+    """Finds no faces, enough to run photos through the whole pipeline"""
+
+    def __init__(self):
+        self.det_model = FakeDetector()
+        self.models = {'recognition': None}
+
+
+def test_next_scan_rescans_photo_edited_in_place(tmp_path, monkeypatch):
+    monkeypatch.setattr(workers, 'create_face_app', lambda *args, **kwargs: FakeFaceApp())
+    photos = tmp_path / "photos"
+    photos.mkdir()
+    photo = photos / "a.jpg"
+    Image.new('RGB', (64, 64)).save(photo)
+
+    db = FaceDatabase(str(tmp_path / "db"))
+    first = workers.ScanWorker(db, ScanApi(str(photos)))
+    first.run()
+    assert first.scan_counts['new'] == 1
+
+    # Rewriting a file leaves the mtime of its folder alone, so the folder is not listed again
+    folder_mtime_ns = os.stat(photos).st_mtime_ns
+    Image.new('RGB', (64, 64), 'white').save(photo)
+    stat = os.stat(photo)
+    os.utime(photo, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    os.utime(photos, ns=(folder_mtime_ns, folder_mtime_ns))
+
+    api = ScanApi(str(photos))
+    second = workers.ScanWorker(db, api)
+    second.run()
+
+    assert any(message.endswith("(0 folders listed, 1 unchanged)") for message in api.messages)
+    assert second.scan_counts == {'new': 0, 'modified': 1, 'retry': 0}
+    assert api.new_photos_found is True
+
+
+def test_copy_of_photo_with_legacy_md5_hash_reuses_its_faces(tmp_path, monkeypatch):
+    monkeypatch.setattr(workers, 'create_face_app', lambda *args, **kwargs: FakeFaceApp())
+    photos = tmp_path / "photos"
+    photos.mkdir()
+    Image.new('RGB', (64, 64), 'red').save(photos / "a.jpg")
+
+    db = FaceDatabase(str(tmp_path / "db"))
+    workers.ScanWorker(db, ScanApi(str(photos))).run()
+
+    # As stored by versions that hashed files with MD5
+    md5 = hashlib.md5((photos / "a.jpg").read_bytes()).hexdigest()
+    db.conn.execute('UPDATE photos SET file_hash = ?', (md5,))
+    db.conn.commit()
+
+    backup = photos / "backup"
+    backup.mkdir()
+    shutil.copyfile(photos / "a.jpg", backup / "a.jpg")
+    api = ScanApi(str(photos))
+    workers.ScanWorker(db, api).run()
+
+    assert "INFO: Duplicate photo, reused 0 face(s) - a.jpg" in api.messages
+
+
+def test_repeated_full_scans_keep_only_latest_run(tmp_path, monkeypatch):
+    monkeypatch.setattr(workers, 'create_face_app', lambda *args, **kwargs: FakeFaceApp())
+    photos = tmp_path / "photos"
+    (photos / "album").mkdir(parents=True)
+    Image.new('RGB', (64, 64)).save(photos / "a.jpg")
+    Image.new('RGB', (64, 64)).save(photos / "album" / "b.jpg")
+
+    db = FaceDatabase(str(tmp_path / "db"))
+    for _ in range(3):
+        workers.ScanWorker(db, ScanApi(str(photos))).run()
+
+    runs = db.conn.execute('SELECT status FROM scan_runs').fetchall()
+    assert [tuple(row) for row in runs] == [('completed',)]
+    assert db.conn.execute('SELECT COUNT(*) FROM scan_run_items').fetchone()[0] == 0
+
+    # Unchanged folders are not rewritten, deleted ones drop out of the index
+    statements = []
+    db.conn.set_trace_callback(statements.append)
+    shutil.rmtree(photos / "album")
+    workers.ScanWorker(db, ScanApi(str(photos))).run()
+    db.conn.set_trace_callback(None)
+
+    index = db.get_directory_index()
+    assert set(index) == {str(photos)}
+    assert index[str(photos)]['subdirs'] == [] and index[str(photos)]['files'] == ["a.jpg"]
+    writes = [
+        statement for statement in map(str.strip, statements)
+        if statement.startswith(('INSERT OR REPLACE INTO scan_directories', 'DELETE FROM scan_directories'))
+    ]
+    assert len(writes) == 2